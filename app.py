@@ -1,18 +1,21 @@
 import streamlit as st
 import pandas as pd
 import time
-import threading
 import os
+import tempfile
 from datetime import datetime, timedelta, UTC
-from db import (init_db, insert_reading, fetch_all, add_device, get_all_devices, 
-                delete_device, update_device_status, get_device_status,
-                add_classroom, get_all_classrooms, delete_classroom, get_classroom_devices,
-                get_classroom_device_stats, update_device_switch_code)
-from tuya_play import get_power_voltage_current, TuyaTokenInfo, request, set_device_switch, get_device_switch
+from db import (migrate, get_schema_version, SCHEMA_VERSION, add_device, delete_device,
+                add_classroom, delete_classroom, get_classroom_view,
+                get_all_classroom_stats, update_device_switch_code, get_device_state, set_device_switch_state,
+                fetch_rollup, get_rollup_energy_summary, STATE_CHANNEL, ROLLUP_RANGE_DAYS)
+from tuya_play import get_token, set_device_switch
+from export import export_readings
+# Same functions as in db, but ranges reaching into archived months also read the Parquet archive
+from archive import fetch_range, get_latest_reading, get_reading_stats, get_energy_summary
+from reading_cache import ReadingCache
+from live import ReadingListener, LIVE_CHECK_SECONDS, LIVE_MAX_STALE_SECONDS
 import json
 
-init_db()
-
 st.set_page_config(page_title="Farashuddin Bhaban (FUB) Energy Monitoring", layout="wide", page_icon="EWU.png")
 
 # SESSION STATE INITIALIZATION
@@ -22,122 +25,75 @@ if 'selected_classroom' not in st.session_state:
     st.session_state['selected_classroom'] = None
 if 'selected_device' not in st.session_state:
     st.session_state['selected_device'] = None
-if 'polling_threads' not in st.session_state:
-    st.session_state['polling_threads'] = {}
-if 'stop_events' not in st.session_state:
-    st.session_state['stop_events'] = {}
-if 'last_polls' not in st.session_state:
-    st.session_state['last_polls'] = {}
 
 UNIT_COST = float(os.getenv("ENERGY_UNIT_COST", 3.80))
-POLL_INTERVAL = int(os.getenv("POLL_INTERVAL_SECONDS", 60))
+EXPORT_FILE_TTL = int(os.getenv("EXPORT_FILE_TTL", 3600))  # seconds a prepared export stays on disk
+EXPORT_FILE_PREFIX = "energy_export_"
+
+def format_age(seconds):
+    if seconds < 60:
+        return f"{int(seconds)}s"
+    if seconds < 3600:
+        return f"{int(seconds // 60)}m"
+    if seconds < 86400:
+        return f"{int(seconds // 3600)}h"
+    return f"{int(seconds // 86400)}d"
 
-# Add default classroom if no classrooms exist
-classrooms = get_all_classrooms()
-if not classrooms:
+def remove_export_file(path):
     try:
-        add_classroom("FUB-101")
-        classrooms = get_all_classrooms()
-    except:
+        os.remove(path)
+    except FileNotFoundError:
         pass
 
-# BACKGROUND POLLING FOR ALL DEVICES
-def poll_loop(device_info, stop_event):
-    device_id = device_info['id']
-    consecutive_failures = 0
-    
-    while not stop_event.is_set():
-        try:
-            result = request("GET", "/v1.0/token", {"grant_type": 1}, None, 
-                           device_info['access_id'], device_info['access_key'], 
-                           device_info['api_endpoint'])
-            
-            if not result.get("success"):
-                consecutive_failures += 1
-                if consecutive_failures > 3:
-                    update_device_status(device_id, "offline")
-                time.sleep(POLL_INTERVAL)
-                continue
-                
-            token_info = TuyaTokenInfo(result)
-            
-            switch_status = get_device_switch(
-                device_info['device_id'],
-                device_info['access_id'],
-                device_info['access_key'],
-                device_info['api_endpoint'],
-                token_info
-            )
-            
-            if switch_status is None:
-                consecutive_failures += 1
-                if consecutive_failures > 3:
-                    update_device_status(device_id, "offline")
-            else:
-                status = "on" if switch_status else "off"
-                update_device_status(device_id, status)
-                consecutive_failures = 0
-            
-            power, voltage, current = get_power_voltage_current(
-                device_info['device_id'],
-                device_info['access_id'],
-                device_info['access_key'],
-                device_info['api_endpoint'],
-                token_info
-            )
-            
-            ts = datetime.now(UTC).strftime("%Y-%m-%d %H:%M:%S")
-            
-            if power is not None or voltage is not None or current is not None:
-                insert_reading(
-                    device_id,
-                    ts, 
-                    float(power) if power is not None else None,
-                    float(voltage) if voltage is not None else None,
-                    float(current) if current is not None else None
-                )
-            
-        except Exception as e:
-            print(f"Polling error for device {device_info['name']}: {e}")
-            consecutive_failures += 1
-            if consecutive_failures > 3:
-                update_device_status(device_id, "offline")
-        
-        time.sleep(POLL_INTERVAL)
+def remove_stale_exports():
+    # Exports of sessions that ended (or moved on) are never downloaded again;
+    # anything older than EXPORT_FILE_TTL is removed, whichever session made it
+    cutoff = time.time() - EXPORT_FILE_TTL
+    with os.scandir(tempfile.gettempdir()) as entries:
+        for entry in entries:
+            if entry.name.startswith(EXPORT_FILE_PREFIX) and entry.stat().st_mtime < cutoff:
+                remove_export_file(entry.path)
 
-def start_all_polling():
-    devices = get_all_devices()
-    for device in devices:
-        device_info = {
-            'id': device[0],
-            'name': device[1],
-            'classroom_id': device[2],
-            'access_id': device[3],
-            'access_key': device[4],
-            'device_id': device[5],
-            'api_endpoint': device[6]
-        }
-        
-        if device_info['id'] not in st.session_state['polling_threads']:
-            stop_event = threading.Event()
-            st.session_state['stop_events'][device_info['id']] = stop_event
-            
-            t = threading.Thread(
-                target=poll_loop, 
-                args=(device_info, stop_event),
-                daemon=True
-            )
-            t.start()
-            st.session_state['polling_threads'][device_info['id']] = t
+@st.cache_resource(show_spinner=False)
+def ensure_schema():
+    # Once per app process: a single query when the schema is current, the
+    # migrations (normally already run by the collector) only after a deploy
+    if get_schema_version() < SCHEMA_VERSION:
+        migrate()
+    return SCHEMA_VERSION
+
+ensure_schema()
+
+@st.cache_resource(show_spinner=False)
+def get_reading_cache():
+    # Shared by every session of this app process
+    return ReadingCache()
+
+reading_cache = get_reading_cache()
+
+@st.cache_resource(show_spinner=False)
+def get_reading_listener():
+    # One LISTEN connection per app process, shared by every session
+    return ReadingListener().start()
 
-start_all_polling()
+def live_cached(name, key, load):
+    # Result of load() kept in the session until `key` changes (it includes the
+    # listener's version of the device) or LIVE_MAX_STALE_SECONDS pass, so
+    # relative ranges keep moving even if no notification arrives
+    entry = st.session_state.get(f'live_{name}')
+    if entry is None or entry['key'] != key or time.monotonic() - entry['loaded_at'] > LIVE_MAX_STALE_SECONDS:
+        entry = {'key': key, 'value': load(), 'loaded_at': time.monotonic()}
+        st.session_state[f'live_{name}'] = entry
+    return entry['value']
 
 # HOME PAGE (CLASSROOM SELECTION)
 if st.session_state['page'] == 'home':
     st.title("FUB Available Classrooms")
-    st.subheader("Select Classroom")
     
-    classrooms = get_all_classrooms()
+    # Counts and live power for every classroom from a single query
+    classrooms = get_all_classroom_stats()
+    st.metric("⚡ Building Power", f"{sum(c['power'] for c in classrooms):.1f} W")
+    st.subheader("Select Classroom")
     
     cols_per_row = 3
     classroom_count = len(classrooms)
@@ -150,15 +106,15 @@ if st.session_state['page'] == 'home':
             
             with cols[col_idx]:
                 if classroom_idx < classroom_count:
-                    classroom = classrooms[classroom_idx]
-                    classroom_id = classroom[0]
-                    classroom_name = classroom[1]
+                    stats = classrooms[classroom_idx]
+                    classroom_id = stats['id']
+                    classroom_name = stats['name']
                     
-                    stats = get_classroom_device_stats(classroom_id)
                     total = stats['total']
                     on_count = stats['on']
                     off_count = stats['off']
                     offline_count = stats['offline']
+                    power = stats['power']
                     
                     if total == 0:
                         bg_color = "#e2e3e5"
@@ -188,7 +144,8 @@ if st.session_state['page'] == 'home':
                             margin-bottom: 10px;
                         ">
                             <div style="font-size: 2em; margin-bottom: 10px;">🚪</div>
-                            <div style="font-size: 1.3em; font-weight: bold; color: #333; margin-bottom: 15px;">{classroom_name}</div>
+                            <div style="font-size: 1.3em; font-weight: bold; color: #333; margin-bottom: 5px;">{classroom_name}</div>
+                            <div style="font-size: 1em; color: #555; margin-bottom: 10px;">⚡ {power:.1f} W</div>
                             <div style="display: flex; gap: 15px; justify-content: center; margin-top: 10px;">
                                 <div style="text-align: center;">
                                     <div style="font-size: 1.5em; font-weight: bold; color: #333;">{total}</div>
@@ -299,6 +256,7 @@ elif st.session_state['page'] == 'classroom':
         if st.button("Delete Classroom", width='stretch'):
             try:
                 delete_classroom(selected_classroom['id'])
+                reading_cache.clear()
                 st.success("Classroom deleted!")
                 time.sleep(1)
                 st.session_state['page'] = 'home'
@@ -307,10 +265,24 @@ elif st.session_state['page'] == 'classroom':
             except Exception as e:
                 st.error(f"Failed to delete: {e}")
     
+    # Classroom energy summed from the daily/hourly rollups, not raw readings
+    now = datetime.now(UTC)
+    classroom_energy = get_rollup_energy_summary(now - timedelta(days=30), now, UNIT_COST,
+                                                 classroom_id=selected_classroom['id'])
+    today_kwh = next((kwh for day, kwh, _ in classroom_energy['daily'] if day == now.date()), 0.0)
+    energy_cols = st.columns(3)
+    with energy_cols[0]:
+        st.metric("Energy Today", f"{today_kwh:.3f} kWh")
+    with energy_cols[1]:
+        st.metric("Energy (30 days)", f"{classroom_energy['total_kwh']:.2f} kWh")
+    with energy_cols[2]:
+        st.metric("Cost (30 days)", f"৳ {classroom_energy['total_cost']:.2f}")
+
     st.divider()
     st.subheader("Devices in this Classroom")
     
-    devices = get_classroom_devices(selected_classroom['id'])
+    # Status and latest reading of every device from a single query
+    devices = get_classroom_view(selected_classroom['id'])
     
     cols_per_row = 3
     device_count = len(devices)
@@ -324,10 +296,16 @@ elif st.session_state['page'] == 'classroom':
             with cols[col_idx]:
                 if device_idx < device_count:
                     device = devices[device_idx]
-                    device_id = device[0]
-                    device_name = device[1]
+                    device_id = device['id']
+                    device_name = device['name']
                     
-                    status = get_device_status(device_id)
+                    status = device['status']
+                    if device['live'] and device['power'] is not None:
+                        reading_text = f"⚡ {device['power']:.1f} W"
+                    elif device['last_seen_seconds'] is not None:
+                        reading_text = f"Last seen {format_age(device['last_seen_seconds'])} ago"
+                    else:
+                        reading_text = "No readings yet"
                     
                     if status == "on":
                         bg_color = "#d4edda"
@@ -359,18 +337,20 @@ elif st.session_state['page'] == 'classroom':
                             <div style="font-size: 2em; margin-bottom: 10px;">{status_icon}</div>
                             <div style="font-size: 1.2em; font-weight: bold; color: #333;">{device_name}</div>
                             <div style="font-size: 0.9em; color: #666; margin-top: 5px; text-transform: capitalize;">{status}</div>
+                            <div style="font-size: 0.9em; color: #333; margin-top: 5px;">{reading_text}</div>
                         </div>
                     """, unsafe_allow_html=True)
                     
                     if st.button(f"Open Dashboard", key=f"open_dev_{device_id}", width='stretch'):
                         st.session_state['selected_device'] = {
-                            'id': device[0],
-                            'name': device[1],
-                            'classroom_id': device[2],
-                            'access_id': device[3],
-                            'access_key': device[4],
-                            'device_id': device[5],
-                            'api_endpoint': device[6]
+                            'id': device['id'],
+                            'name': device['name'],
+                            'classroom_id': device['classroom_id'],
+                            'access_id': device['access_id'],
+                            'access_key': device['access_key'],
+                            'device_id': device['device_id'],
+                            'api_endpoint': device['api_endpoint'],
+                            'switch_code': device['switch_code'] or 'switch'
                         }
                         st.session_state['page'] = 'dashboard'
                         st.rerun()
@@ -461,9 +441,8 @@ elif st.session_state['page'] == 'dashboard':
     with col3:
         if st.button("🗑️ Delete Device", width='stretch'):
             try:
-                if selected_device['id'] in st.session_state['stop_events']:
-                    st.session_state['stop_events'][selected_device['id']].set()
                 delete_device(selected_device['id'])
+                reading_cache.invalidate(selected_device['id'])
                 st.success("Device deleted!")
                 time.sleep(1)
                 st.session_state['page'] = 'classroom'
@@ -475,52 +454,66 @@ elif st.session_state['page'] == 'dashboard':
     st.divider()
     
 # SIDEBAR
-    st.sidebar.header("⚙️ Device Control")
-    
-    try:
-        result = request("GET", "/v1.0/token", {"grant_type": 1}, None, 
-                       selected_device['access_id'], selected_device['access_key'], 
-                       selected_device['api_endpoint'])
-        token_info = TuyaTokenInfo(result)
-        
-        switch_state = get_device_switch(
-            selected_device['device_id'],
-            selected_device['access_id'],
-            selected_device['access_key'],
-            selected_device['api_endpoint'],
-            token_info
-        )
-        
-        col1, col2 = st.sidebar.columns(2)
-        if col1.button("🟢 Turn ON", width='stretch', disabled=(switch_state == True)):
-            success, actual_code = set_device_switch(True, selected_device['device_id'], selected_device['access_id'], 
-                            selected_device['access_key'], selected_device['api_endpoint'], token_info,
-                            selected_device.get('switch_code', 'switch'))
-            if success:
-                if actual_code != selected_device.get('switch_code'):
-                    update_device_switch_code(selected_device['id'], actual_code)
-                    selected_device['switch_code'] = actual_code
-                st.sidebar.success("Device turned ON")
-                time.sleep(1)
-                st.rerun()
-        
-        if col2.button("🔴 Turn OFF", width='stretch', disabled=(switch_state == False)):
-            success, actual_code = set_device_switch(False, selected_device['device_id'], selected_device['access_id'], 
-                            selected_device['access_key'], selected_device['api_endpoint'], token_info,
-                            selected_device.get('switch_code', 'switch'))
-            if success:
-                if actual_code != selected_device.get('switch_code'):
-                    update_device_switch_code(selected_device['id'], actual_code)
-                    selected_device['switch_code'] = actual_code
-                st.sidebar.warning("Device turned OFF")
-                time.sleep(1)
-                st.rerun()
-        
-        status_color = "🟢" if switch_state else "🔴"
-        status_text = "ON" if switch_state else "OFF"
-        st.sidebar.metric("Current Status", f"{status_color} {status_text}")
-    except:
-        st.sidebar.error("Unable to connect to device")
+    live_updates = st.session_state.get('live_updates', True)
+    reading_listener = get_reading_listener()
+
+    # With live updates on, the fragments below re-run on their own every
+    # LIVE_CHECK_SECONDS instead of rerunning the page, and only query the
+    # database once the listener saw a NOTIFY for this device
+    @st.fragment(run_every=LIVE_CHECK_SECONDS if live_updates else None)
+    def device_control():
+        st.header("⚙️ Device Control")
+
+        # Rendered from the state the collector keeps in device_state; the cloud
+        # is only contacted when a button is pressed. Keyed on state changes
+        # only, so new readings do not reload it
+        state_key = (selected_device['id'], reading_listener.version(selected_device['id'], STATE_CHANNEL))
+        state = live_cached('device_state', state_key, lambda: get_device_state(selected_device['id']))
+        switch_state = state['switch'] if state else None
+
+        col1, col2 = st.columns(2)
+        for col, value, label in ((col1, True, "🟢 Turn ON"), (col2, False, "🔴 Turn OFF")):
+            if col.button(label, width='stretch', disabled=(switch_state is value)):
+                try:
+                    token_info = get_token(selected_device['access_id'], selected_device['access_key'],
+                                           selected_device['api_endpoint'])
+                    success, actual_code = set_device_switch(
+                        value, selected_device['device_id'], selected_device['access_id'],
+                        selected_device['access_key'], selected_device['api_endpoint'], token_info,
+                        selected_device.get('switch_code', 'switch')
+                    )
+                except Exception:
+                    success = False
+                if success:
+                    if actual_code != selected_device.get('switch_code'):
+                        update_device_switch_code(selected_device['id'], actual_code)
+                        selected_device['switch_code'] = actual_code
+                    set_device_switch_state(selected_device['id'], value)
+                    if value:
+                        st.success("Device turned ON")
+                    else:
+                        st.warning("Device turned OFF")
+                    time.sleep(1)
+                    st.session_state.pop('live_device_state', None)
+                    st.rerun()
+                else:
+                    st.error("Unable to connect to device")
+
+        if switch_state is None:
+            st.metric("Current Status", "⚪ Unknown")
+        else:
+            st.metric("Current Status", "🟢 ON" if switch_state else "🔴 OFF")
+        if state and state['last_seen']:
+            last_seen = (datetime.now(UTC).replace(tzinfo=None) - state['last_seen']).total_seconds()
+            caption = f"Last seen {format_age(max(last_seen, 0))} ago"
+            if state['failures']:
+                caption += f" · {state['failures']} failed polls"
+            st.caption(caption)
+        else:
+            st.caption("Waiting for the collector's first poll")
+
+    with st.sidebar:
+        device_control()
     
     st.sidebar.divider()
     
@@ -546,7 +539,8 @@ elif st.session_state['page'] == 'dashboard':
         start_time = datetime.combine(start_date, start_time_input).replace(tzinfo=UTC)
         end_time = datetime.combine(end_date, end_time_input).replace(tzinfo=UTC)
     
-    auto_refresh = st.sidebar.checkbox("Auto-refresh (60s)", value=False)
+    st.sidebar.checkbox("Live updates", value=True, key='live_updates',
+                        help="Refresh metrics and charts as soon as new readings arrive")
     
     st.sidebar.divider()
     
@@ -561,158 +555,217 @@ elif st.session_state['page'] == 'dashboard':
     )
     
 # LOAD DATA
-    rows = fetch_all(selected_device['id'])
-    if rows:
-        df = pd.DataFrame(rows, columns=["timestamp", "power", "voltage", "current"])
-        df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
-    else:
-        df = pd.DataFrame(columns=["timestamp", "power", "voltage", "current"])
+    time_filters = {
+        "Last Hour": timedelta(hours=1),
+        "Last 24 Hours": timedelta(days=1),
+        "Last 7 Days": timedelta(days=7),
+        "Last 30 Days": timedelta(days=30),
+    }
+
+    def current_range():
+        if range_option == "Custom Range" and start_time and end_time:
+            return start_time, end_time
+        now = datetime.now(UTC)
+        return now - time_filters.get(range_option, timedelta(days=1)), now
+
+    def load_view():
+        range_start, range_end = current_range()
+        # Long ranges are charted from the hourly or daily rollups the collector
+        # maintains (one averaged point per bucket) and their energy is summed
+        # from the rollups too. Shorter recent ranges come from the shared
+        # cache, which only fetches readings written since the last refresh;
+        # older ones are downsampled in SQL or read from the archive. Either
+        # way at most FETCH_MAX_POINTS rows.
+        cached = reading_cache.get(selected_device['id'])
+        if range_end - range_start > timedelta(days=ROLLUP_RANGE_DAYS):
+            rollup = fetch_rollup(selected_device['id'], range_start, range_end)
+            df_filtered = pd.DataFrame([(row[0], row[2], row[6], row[7]) for row in rollup],
+                                       columns=['timestamp', 'power', 'voltage', 'current'])
+            energy = get_rollup_energy_summary(range_start, range_end, unit_cost_input,
+                                               device_id=selected_device['id'])
+        else:
+            if cached.covers(range_start):
+                df_filtered = pd.DataFrame(cached.fetch_range(range_start, range_end))
+            else:
+                df_filtered = pd.DataFrame(fetch_range(selected_device['id'], range_start, range_end))
+            # Trapezoidal energy integrated in SQL; outages longer than ENERGY_MAX_GAP_SECONDS count as zero
+            energy = get_energy_summary(range_start, range_end, unit_cost_input, device_id=selected_device['id'])
+        df_filtered['timestamp'] = pd.to_datetime(df_filtered['timestamp'], utc=True)
+        if cached.covers(range_start):
+            latest = cached.latest(before=range_end) or get_latest_reading(selected_device['id'], before=range_end)
+            stats = cached.stats(range_start, range_end)
+        else:
+            latest = get_latest_reading(selected_device['id'], before=range_end)
+            stats = get_reading_stats(selected_device['id'], range_start, range_end)
+        return df_filtered, latest, energy, stats
+
+    @st.fragment(run_every=LIVE_CHECK_SECONDS if live_updates else None)
+    def live_view():
+        view_key = (selected_device['id'], range_option, start_time, end_time, unit_cost_input,
+                    reading_listener.version(selected_device['id']))
+        df_filtered, latest, energy, stats = live_cached('view', view_key, load_view)
+
+# METRICS
+        if latest is not None:
+            current_power = latest[1] if latest[1] is not None else 0.0
+            current_voltage = latest[2] if latest[2] is not None else 0.0
+            current_current = latest[3] if latest[3] is not None else 0.0
+        else:
+            current_power = 0.0
+            current_voltage = 0.0
+            current_current = 0.0
     
-    now = datetime.now(UTC)
-    if range_option == "Custom Range" and start_time and end_time:
-        df_filtered = df[(df['timestamp'] >= start_time) & (df['timestamp'] <= end_time)].copy()
-    else:
-        time_filters = {
-            "Last Hour": timedelta(hours=1),
-            "Last 24 Hours": timedelta(days=1),
-            "Last 7 Days": timedelta(days=7),
-            "Last 30 Days": timedelta(days=30),
-        }
-        selected_delta = time_filters.get(range_option)
-        if selected_delta:
-            cutoff = now - selected_delta
-            df_filtered = df[df['timestamp'] >= cutoff].copy()
+        if current_voltage > 0 and current_current > 0:
+            apparent_power = current_voltage * current_current
+            power_factor = (current_power / apparent_power) if apparent_power > 0 else 0.0
         else:
-            df_filtered = df.copy()
+            power_factor = 0.0
     
-# METRICS
-    latest = df_filtered.iloc[-1] if not df_filtered.empty else None
-    if latest is not None:
-        current_power = latest['power'] if pd.notna(latest['power']) else 0.0
-        current_voltage = latest['voltage'] if pd.notna(latest['voltage']) else 0.0
-        current_current = latest['current'] if pd.notna(latest['current']) else 0.0
-    else:
-        current_power = 0.0
-        current_voltage = 0.0
-        current_current = 0.0
-    
-    if current_voltage > 0 and current_current > 0:
-        apparent_power = current_voltage * current_current
-        power_factor = (current_power / apparent_power) if apparent_power > 0 else 0.0
-    else:
-        power_factor = 0.0
-    
-    if not df_filtered.empty and df_filtered['power'].notna().any():
-        df_sorted = df_filtered.sort_values('timestamp')
-        df_sorted['delta_s'] = df_sorted['timestamp'].diff().dt.total_seconds().fillna(0)
-        df_sorted['energy_kwh_interval'] = df_sorted['power'] * df_sorted['delta_s'] / 3_600_000.0
-        total_kwh = df_sorted['energy_kwh_interval'].sum()
-    else:
-        total_kwh = 0.0
-        df_sorted = df_filtered.copy()
-    
-    total_cost = total_kwh * unit_cost_input
-    
-    st.subheader("⚡ Real-Time Metrics")
-    metric_cols = st.columns(4)
-    
-    with metric_cols[0]:
-        st.metric("Voltage (V)", f"{current_voltage:.1f}")
-    with metric_cols[1]:
-        st.metric("Current (A)", f"{current_current:.3f}")
-    with metric_cols[2]:
-        st.metric("Power (W)", f"{current_power:.2f}")
-    with metric_cols[3]:
-        st.metric("Power Factor", f"{power_factor:.3f}")
+        total_kwh = energy['total_kwh']
+        total_cost = energy['total_cost']
     
-    st.divider()
+        st.subheader("⚡ Real-Time Metrics")
+        metric_cols = st.columns(4)
     
-    st.subheader("💰 Cost Analysis")
-    cost_cols = st.columns(4)
+        with metric_cols[0]:
+            st.metric("Voltage (V)", f"{current_voltage:.1f}")
+        with metric_cols[1]:
+            st.metric("Current (A)", f"{current_current:.3f}")
+        with metric_cols[2]:
+            st.metric("Power (W)", f"{current_power:.2f}")
+        with metric_cols[3]:
+            st.metric("Power Factor", f"{power_factor:.3f}")
     
-    with cost_cols[0]:
-        st.metric("Total Energy", f"{total_kwh:.4f} kWh")
-    with cost_cols[1]:
-        st.metric("Total Cost", f"৳ {total_cost:.2f}")
-    with cost_cols[2]:
-        if range_option == "Custom Range" and start_time and end_time:
-            days = max((end_time - start_time).days, 1)
-        else:
-            days = time_filters.get(range_option, timedelta(days=1)).days if range_option != "Custom Range" else 1
-        
-        avg_daily_kwh = total_kwh / max(days, 1)
-        avg_daily_cost = avg_daily_kwh * unit_cost_input
-        st.metric("Avg Daily Cost", f"৳ {avg_daily_cost:.2f}")
-    with cost_cols[3]:
-        projected_monthly = avg_daily_cost * 30
-        st.metric("Projected Monthly", f"৳ {projected_monthly:.2f}")
+        st.divider()
     
-    st.divider()
+        st.subheader("💰 Cost Analysis")
+        cost_cols = st.columns(4)
     
-    if not df_filtered.empty:
-        st.subheader("📈 Power Consumption Over Time")
-        chart_df = df_filtered.set_index('timestamp')[['power']].dropna()
-        if not chart_df.empty:
-            st.line_chart(chart_df, height=400)
+        with cost_cols[0]:
+            st.metric("Total Energy", f"{total_kwh:.4f} kWh")
+        with cost_cols[1]:
+            st.metric("Total Cost", f"৳ {total_cost:.2f}")
+        with cost_cols[2]:
+            if range_option == "Custom Range" and start_time and end_time:
+                days = max((end_time - start_time).days, 1)
+            else:
+                days = time_filters.get(range_option, timedelta(days=1)).days if range_option != "Custom Range" else 1
         
-        st.subheader("🔌 Voltage Over Time")
-        voltage_df = df_filtered.set_index('timestamp')[['voltage']].dropna()
-        if not voltage_df.empty:
-            st.line_chart(voltage_df, height=400)
+            avg_daily_kwh = total_kwh / max(days, 1)
+            avg_daily_cost = avg_daily_kwh * unit_cost_input
+            st.metric("Avg Daily Cost", f"৳ {avg_daily_cost:.2f}")
+        with cost_cols[3]:
+            projected_monthly = avg_daily_cost * 30
+            st.metric("Projected Monthly", f"৳ {projected_monthly:.2f}")
+    
+        st.divider()
+    
+        if not df_filtered.empty:
+            st.subheader("📈 Power Consumption Over Time")
+            chart_df = df_filtered.set_index('timestamp')[['power']].dropna()
+            if not chart_df.empty:
+                st.line_chart(chart_df, height=400)
         
-        st.subheader("⚡ Current Over Time")
-        current_df = df_filtered.set_index('timestamp')[['current']].dropna()
-        if not current_df.empty:
-            st.line_chart(current_df, height=400)
+            st.subheader("🔌 Voltage Over Time")
+            voltage_df = df_filtered.set_index('timestamp')[['voltage']].dropna()
+            if not voltage_df.empty:
+                st.line_chart(voltage_df, height=400)
         
-        if range_option in ["Last 7 Days", "Last 30 Days"] or (range_option == "Custom Range" and days > 1):
-            st.subheader("📊 Daily Summary")
-            if not df_sorted.empty and 'energy_kwh_interval' in df_sorted.columns:
-                daily_energy = df_sorted.groupby(df_sorted['timestamp'].dt.date)['energy_kwh_interval'].sum()
-                daily_summary = pd.DataFrame({
-                    'Date': daily_energy.index,
-                    'Energy (kWh)': daily_energy.values,
-                    'Cost (৳)': daily_energy.values * unit_cost_input
-                })
-                daily_summary = daily_summary.sort_values('Date', ascending=False)
-                st.dataframe(daily_summary, width='stretch', hide_index=True)
+            st.subheader("⚡ Current Over Time")
+            current_df = df_filtered.set_index('timestamp')[['current']].dropna()
+            if not current_df.empty:
+                st.line_chart(current_df, height=400)
         
-        with st.expander("📊 Detailed Statistics"):
-            stat_cols = st.columns(3)
-            with stat_cols[0]:
-                st.metric("Avg Power", f"{df_filtered['power'].mean():.2f} W")
-                st.metric("Max Power", f"{df_filtered['power'].max():.2f} W")
-                st.metric("Min Power", f"{df_filtered['power'].min():.2f} W")
-            with stat_cols[1]:
-                st.metric("Avg Voltage", f"{df_filtered['voltage'].mean():.2f} V")
-                st.metric("Max Voltage", f"{df_filtered['voltage'].max():.2f} V")
-                st.metric("Min Voltage", f"{df_filtered['voltage'].min():.2f} V")
-            with stat_cols[2]:
-                st.metric("Avg Current", f"{df_filtered['current'].mean():.3f} A")
-                st.metric("Max Current", f"{df_filtered['current'].max():.3f} A")
-                st.metric("Min Current", f"{df_filtered['current'].min():.3f} A")
+            if range_option in ["Last 7 Days", "Last 30 Days"] or (range_option == "Custom Range" and days > 1):
+                st.subheader("📊 Daily Summary")
+                if energy['daily']:
+                    daily_summary = pd.DataFrame(energy['daily'], columns=['Date', 'Energy (kWh)', 'Cost (৳)'])
+                    daily_summary = daily_summary.sort_values('Date', ascending=False)
+                    st.dataframe(daily_summary, width='stretch', hide_index=True)
         
-        st.subheader("📋 Raw Data Readings")
-        display_df = df_filtered[['timestamp', 'power', 'voltage', 'current']].sort_values('timestamp', ascending=False)
-        display_df['timestamp'] = display_df['timestamp'].dt.strftime('%Y-%m-%d %H:%M:%S')
-        st.dataframe(display_df.head(100), width='stretch', hide_index=True)
+            with st.expander("📊 Detailed Statistics"):
+                stat_cols = st.columns(3)
+                with stat_cols[0]:
+                    st.metric("Avg Power", f"{stats['power']['avg'] or 0:.2f} W")
+                    st.metric("Max Power", f"{stats['power']['max'] or 0:.2f} W")
+                    st.metric("Min Power", f"{stats['power']['min'] or 0:.2f} W")
+                with stat_cols[1]:
+                    st.metric("Avg Voltage", f"{stats['voltage']['avg'] or 0:.2f} V")
+                    st.metric("Max Voltage", f"{stats['voltage']['max'] or 0:.2f} V")
+                    st.metric("Min Voltage", f"{stats['voltage']['min'] or 0:.2f} V")
+                with stat_cols[2]:
+                    st.metric("Avg Current", f"{stats['current']['avg'] or 0:.3f} A")
+                    st.metric("Max Current", f"{stats['current']['max'] or 0:.3f} A")
+                    st.metric("Min Current", f"{stats['current']['min'] or 0:.3f} A")
         
-        st.divider()
-        export_col1, export_col2 = st.columns([3, 1])
-        with export_col1:
-            st.caption(f"📥 Export data for {selected_device['name']}")
-        with export_col2:
-            csv = df_filtered.to_csv(index=False)
-            st.download_button(
-                "⬇️ Download CSV", 
-                csv, 
-                file_name=f"energy_{selected_device['name'].replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}.csv",
-                mime="text/csv",
-                width='stretch'
-            )
-    else:
-        st.info("📊 No data available yet. The system is collecting readings in the background.")
-    
-    if auto_refresh:
-        time.sleep(60)
-        st.rerun()
+            st.subheader("📋 Raw Data Readings")
+            display_df = df_filtered[['timestamp', 'power', 'voltage', 'current']].sort_values('timestamp', ascending=False)
+            display_df['timestamp'] = display_df['timestamp'].dt.strftime('%Y-%m-%d %H:%M:%S')
+            st.dataframe(display_df.head(100), width='stretch', hide_index=True)
+        else:
+            st.info("📊 No data available yet. Readings appear once the collector service has polled this device.")
+
+    live_view()
+
+    st.divider()
+    st.subheader("📥 Export Data")
+    export_cols = st.columns(4)
+    with export_cols[0]:
+        export_scope = st.selectbox("Scope", ["This device", "This classroom", "Whole building"])
+    with export_cols[1]:
+        export_format = st.selectbox("Format", ["CSV", "Parquet"])
+    with export_cols[2]:
+        export_resample = st.selectbox("Resolution", ["Raw readings", "1 minute", "15 minutes", "1 hour", "1 day"])
+    with export_cols[3]:
+        # Streamed from PostgreSQL into a temp file, never built as a DataFrame.
+        # The file belongs to this exact selection (custom start/end included);
+        # once the selection changes it is deleted rather than offered again.
+        export_key = (selected_device['id'], range_option, start_time, end_time,
+                      export_scope, export_format, export_resample)
+        export_file = st.session_state.get('export_file')
+        if export_file and export_file['key'] != export_key:
+            remove_export_file(export_file['path'])
+            st.session_state.pop('export_file')
+        if st.button("📦 Prepare Export", width='stretch'):
+            if export_file:
+                remove_export_file(export_file['path'])
+                st.session_state.pop('export_file', None)
+            remove_stale_exports()
+            fmt = export_format.lower()
+            range_start, range_end = current_range()
+            scope_name = {
+                "This device": selected_device['name'],
+                "This classroom": (st.session_state.get('selected_classroom') or {}).get('name', "classroom"),
+                "Whole building": "FUB",
+            }[export_scope]
+            with tempfile.NamedTemporaryFile(prefix=EXPORT_FILE_PREFIX, suffix=f".{fmt}", delete=False) as f:
+                try:
+                    rows = export_readings(
+                        f, range_start, range_end, fmt,
+                        device_id=selected_device['id'] if export_scope == "This device" else None,
+                        classroom_id=selected_device['classroom_id'] if export_scope == "This classroom" else None,
+                        resample=None if export_resample == "Raw readings" else export_resample
+                    )
+                except Exception:
+                    f.close()
+                    remove_export_file(f.name)
+                    raise
+            st.session_state['export_file'] = {
+                'key': export_key,
+                'path': f.name,
+                'rows': rows,
+                'file_name': f"energy_{scope_name.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}.{fmt}",
+                'mime': "text/csv" if fmt == "csv" else "application/vnd.apache.parquet",
+            }
+        export_file = st.session_state.get('export_file')
+        if export_file and export_file['key'] == export_key and os.path.exists(export_file['path']):
+            # download_button reads the whole file into memory, so one prepared
+            # export costs its size in app memory until the selection changes
+            with open(export_file['path'], 'rb') as f:
+                st.download_button(
+                    f"⬇️ Download ({export_file['rows']} rows)", 
+                    f, 
+                    file_name=export_file['file_name'],
+                    mime=export_file['mime'],
+                    width='stretch'
+                )
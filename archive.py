@@ -0,0 +1,396 @@
+import argparse
+import itertools
+import os
+import re
+import time
+from datetime import date, datetime, UTC
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from db import (get_connection, to_utc_naive, month_start, add_months, partition_name,
+                energy_usage_is_partitioned, get_classroom_devices, READING_COLUMNS, FETCH_MAX_POINTS,
+                ENERGY_MAX_GAP_SECONDS, fetch_range as fetch_hot_range,
+                get_latest_reading as get_hot_latest_reading, get_reading_stats as get_hot_reading_stats,
+                get_energy_summary as get_hot_energy_summary)
+
+# Cold storage tier for closed months. archive_month() copies a month of
+# energy_usage into Parquet files laid out as
+#
+#   ARCHIVE_DIR/month=2025-01/device_id=17/part-<ns>.parquet
+#
+# (one file per device and archiving run, sorted by timestamp) and then
+# removes the month from PostgreSQL. Rollups are kept, they are small.
+# The read functions below have the same signatures and results as their db
+# counterparts and merge archived months with the hot table, so callers do
+# not need to know where a range lives. Ranges that do not touch an archived
+# month go straight to PostgreSQL. ARCHIVE_DIR is a local path: the collector
+# (which archives) and every app or export process (which read) must see the
+# same directory, e.g. on one host or a shared network volume.
+#
+#   python archive.py --keep-months 3                  # archive everything older
+#   python archive.py --scan --start 2025-01-01        # year report from Parquet only
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ARCHIVE_AFTER_MONTHS", 0))  # closed months kept hot, 0 = never archive
+ARCHIVE_CHUNK_ROWS = int(os.getenv("ARCHIVE_CHUNK_ROWS", 100000))
+
+ARCHIVE_SCHEMA = pa.schema([
+    ('timestamp', pa.timestamp('us')),
+    ('power', pa.float64()),
+    ('voltage', pa.float64()),
+    ('current', pa.float64()),
+])
+ARCHIVE_PARTITIONING = ds.partitioning(
+    pa.schema([('month', pa.string()), ('device_id', pa.int32())]), flavor='hive'
+)
+READINGS_SCHEMA = pa.schema([('device_id', pa.int32())] + list(ARCHIVE_SCHEMA))
+
+
+# ARCHIVING FUNCTIONS
+def month_dir(month, archive_dir=ARCHIVE_DIR):
+    return os.path.join(archive_dir, f"month={month:%Y-%m}")
+
+def archived_months(archive_dir=ARCHIVE_DIR):
+    # Sorted first days of the months that have files in the archive
+    if not os.path.isdir(archive_dir):
+        return []
+    months = []
+    for name in os.listdir(archive_dir):
+        match = re.fullmatch(r'month=(\d{4})-(\d{2})', name)
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+def months_between(start, end, archive_dir=ARCHIVE_DIR):
+    # Archived months overlapping [start, end)
+    first, last = month_start(to_utc_naive(start)), to_utc_naive(end)
+    return [month for month in archived_months(archive_dir)
+            if month >= first and datetime(month.year, month.month, 1) < last]
+
+def touches_archive(start, end, archive_dir=ARCHIVE_DIR):
+    return bool(months_between(start, end, archive_dir))
+
+def write_device_file(directory, rows):
+    # Written under a dot-name (ignored by readers) and renamed by the caller
+    os.makedirs(directory, exist_ok=True)
+    name = f"part-{time.time_ns()}.parquet"
+    tmp_path = os.path.join(directory, f".{name}.tmp")
+    columns = list(zip(*rows))
+    table = pa.table(
+        {field.name: pa.array(values, type=field.type) for field, values in zip(ARCHIVE_SCHEMA, columns[1:])},
+        schema=ARCHIVE_SCHEMA
+    )
+    pq.write_table(table, tmp_path, compression='zstd')
+    return tmp_path, os.path.join(directory, name)
+
+def archive_month(month, archive_dir=ARCHIVE_DIR):
+    # Moves one closed month to Parquet and returns the number of readings.
+    # Exactly the readings copied are removed, nothing that lands meanwhile:
+    # - partitioned: the month's partition is locked against writes while it is
+    #   copied, then truncated rather than dropped, so a late reading for the
+    #   month still has somewhere to go. Current readings go to another
+    #   partition and are not held up.
+    # - plain table: a table lock would stop all ingest, so the month is
+    #   deleted and captured into a temporary table in one statement and
+    #   copied from there. A late reading for the month either waits for the
+    #   commit or is not deleted, and is picked up by the next run.
+    month = month_start(month)
+    if month >= month_start(datetime.now(UTC)):
+        raise ValueError(f"{month:%Y-%m} is not closed yet")
+    next_month = add_months(month, 1)
+    start, end = datetime(month.year, month.month, 1), datetime(next_month.year, next_month.month, 1)
+    directory = month_dir(month, archive_dir)
+
+    files = []
+    rows = 0
+    published = False
+    try:
+        with get_connection(statement_timeout=0) as conn:
+            c = conn.cursor()
+            partition = None
+            if energy_usage_is_partitioned(c):
+                c.execute('SELECT to_regclass(%s)', (partition_name(month),))
+                if c.fetchone()[0] is None:
+                    return 0
+                partition = partition_name(month)
+                c.execute(f'LOCK TABLE {partition} IN SHARE MODE')
+                source = partition
+            else:
+                c.execute('''
+                    CREATE TEMP TABLE archive_rows ON COMMIT DROP AS
+                    SELECT device_id, timestamp, power, voltage, current FROM energy_usage
+                    WITH NO DATA
+                ''')
+                c.execute('''
+                    WITH moved AS (
+                        DELETE FROM energy_usage
+                        WHERE timestamp >= %s AND timestamp < %s
+                        RETURNING device_id, timestamp, power, voltage, current
+                    )
+                    INSERT INTO archive_rows SELECT * FROM moved
+                ''', (start, end))
+                source = 'archive_rows'
+
+            # Named cursor: rows stay on the server until fetched
+            reader = conn.cursor(name='energy_archive')
+            reader.itersize = ARCHIVE_CHUNK_ROWS
+            reader.execute(f'''
+                SELECT device_id, timestamp, power, voltage, current
+                FROM {source}
+                WHERE timestamp >= %s AND timestamp < %s
+                ORDER BY device_id, timestamp
+            ''', (start, end))
+            device_rows = []
+            while True:
+                chunk = reader.fetchmany(ARCHIVE_CHUNK_ROWS)
+                if not chunk:
+                    break
+                for device_id, group in itertools.groupby(chunk, key=lambda row: row[0]):
+                    if device_rows and device_rows[0][0] != device_id:
+                        files.append(write_device_file(os.path.join(directory, f"device_id={device_rows[0][0]}"),
+                                                       device_rows))
+                        device_rows = []
+                    device_rows.extend(group)
+                rows += len(chunk)
+            if device_rows:
+                files.append(write_device_file(os.path.join(directory, f"device_id={device_rows[0][0]}"),
+                                               device_rows))
+            reader.close()
+            if rows == 0:
+                return 0
+
+            if partition:
+                c.execute(f'TRUNCATE {partition}')
+
+            # Published before the commit, so the readings are never only in
+            # files readers ignore. Until the commit a reader may see the month
+            # in both tiers; read_readings keeps the hot row.
+            for tmp_path, path in files:
+                os.replace(tmp_path, path)
+            published = True
+    except Exception:
+        if published:
+            # The commit itself failed and may or may not have happened, so
+            # the files stay; readers drop the duplicates while both exist
+            print(f"⚠️ Commit of {month:%Y-%m} failed after its files were published to {directory}; "
+                  f"readings still in PostgreSQL win over the archived copies")
+        raise
+    finally:
+        if not published:
+            # Rolled back: the readings are still in PostgreSQL
+            for tmp_path, path in files:
+                for leftover in (tmp_path, path):
+                    if os.path.exists(leftover):
+                        os.remove(leftover)
+
+    print(f"🧊 Archived {rows} readings of {month:%Y-%m} to {directory}")
+    return rows
+
+def archive_closed_months(keep_months: int = ARCHIVE_AFTER_MONTHS, archive_dir=ARCHIVE_DIR, now=None):
+    # Archives every month that ended more than `keep_months` months before
+    # the current one; returns [(month, readings)] of the months moved.
+    if keep_months <= 0:
+        return []
+    cutoff = add_months(month_start(now or datetime.now(UTC)), -keep_months)
+    with get_connection(statement_timeout=0) as conn:
+        c = conn.cursor()
+        c.execute('SELECT MIN(timestamp) FROM energy_usage WHERE timestamp < %s', (cutoff,))
+        oldest = c.fetchone()[0]
+    if oldest is None:
+        return []
+
+    archived = []
+    month = month_start(oldest)
+    while month < cutoff:
+        rows = archive_month(month, archive_dir)
+        if rows:
+            archived.append((month, rows))
+        month = add_months(month, 1)
+    return archived
+
+
+# QUERY FUNCTIONS
+def empty_readings():
+    return READINGS_SCHEMA.empty_table()
+
+def read_cold(start, end, device_ids=None, archive_dir=ARCHIVE_DIR):
+    # Archived readings in [start, end) as an Arrow table (READINGS_SCHEMA).
+    # Only the matching month/device directories are opened, and row groups
+    # outside the time range are skipped using the Parquet statistics.
+    months = months_between(start, end, archive_dir)
+    if not months:
+        return empty_readings()
+    start, end = to_utc_naive(start), to_utc_naive(end)
+    dataset = ds.dataset(archive_dir, format='parquet', partitioning=ARCHIVE_PARTITIONING)
+    condition = (
+        ds.field('month').isin([f"{month:%Y-%m}" for month in months])
+        & (ds.field('timestamp') >= pa.scalar(start, type=pa.timestamp('us')))
+        & (ds.field('timestamp') < pa.scalar(end, type=pa.timestamp('us')))
+    )
+    if device_ids is not None:
+        condition &= ds.field('device_id').isin(list(device_ids))
+    return dataset.to_table(columns=READINGS_SCHEMA.names, filter=condition).cast(READINGS_SCHEMA)
+
+def read_hot(start, end, device_ids=None):
+    start, end = to_utc_naive(start), to_utc_naive(end)
+    with get_connection() as conn:
+        c = conn.cursor()
+
+        c.execute('''
+            SELECT device_id, timestamp, power, voltage, current
+            FROM energy_usage
+            WHERE timestamp >= %s AND timestamp < %s
+            AND (%s::integer[] IS NULL OR device_id = ANY(%s::integer[]))
+        ''', (start, end, device_ids, device_ids))
+        rows = c.fetchall()
+    if not rows:
+        return empty_readings()
+    return pa.table(
+        {field.name: pa.array(values, type=field.type) for field, values in zip(READINGS_SCHEMA, zip(*rows))},
+        schema=READINGS_SCHEMA
+    )
+
+def read_readings(start, end, device_ids=None, archive_dir=ARCHIVE_DIR):
+    # Cold and hot readings in [start, end) as a DataFrame sorted by device and
+    # time. A month that was copied but not yet removed from PostgreSQL (e.g.
+    # an interrupted run) would appear twice; the hot row wins.
+    if device_ids is not None:
+        device_ids = list(device_ids)
+    table = pa.concat_tables([read_cold(start, end, device_ids, archive_dir), read_hot(start, end, device_ids)])
+    df = table.to_pandas()
+    df = df.drop_duplicates(['device_id', 'timestamp'], keep='last')
+    return df.sort_values(['device_id', 'timestamp'], ignore_index=True)
+
+def interval_energy(df, max_gap=ENERGY_MAX_GAP_SECONDS):
+    # kWh of the trapezoid ending at each reading (NaN for the first reading of
+    # a device and for gaps longer than max_gap), same rule as get_energy_summary
+    previous = df.groupby('device_id')[['timestamp', 'power']].shift()
+    seconds = (df['timestamp'] - previous['timestamp']).dt.total_seconds()
+    kwh = (df['power'] + previous['power']) / 2 * seconds / 3600000
+    return kwh.where(seconds <= max_gap)
+
+def optional_float(value):
+    return None if pd.isna(value) else float(value)
+
+def fetch_range(device_id: int, start, end, max_points: int = FETCH_MAX_POINTS):
+    # db.fetch_range over hot and archived readings
+    if not touches_archive(start, end):
+        return fetch_hot_range(device_id, start, end, max_points)
+    start, end = to_utc_naive(start), to_utc_naive(end)
+    df = read_readings(start, end, [device_id])
+    if len(df) > max_points:
+        # Integer microseconds, so readings on a bucket edge land where SQL puts them
+        width = pd.Timedelta(seconds=max((end - start).total_seconds() / max_points, 1)).round('us')
+        df = df.assign(timestamp=start + (df['timestamp'] - start) // width * width)
+        df = df.groupby('timestamp', as_index=False)[list(READING_COLUMNS[1:])].mean()
+    return {col: df[col].tolist() for col in READING_COLUMNS}
+
+def get_latest_reading(device_id: int, before=None):
+    # db.get_latest_reading, falling back to the newest archived month
+    latest = get_hot_latest_reading(device_id, before)
+    if latest is not None:
+        return latest
+    before = to_utc_naive(before) or datetime.now(UTC).replace(tzinfo=None)
+    for month in reversed(months_between(datetime(1970, 1, 1), before)):
+        table = read_cold(datetime(month.year, month.month, 1), before, [device_id])
+        if table.num_rows:
+            row = table.sort_by([('timestamp', 'descending')]).slice(0, 1).to_pylist()[0]
+            return tuple(row[col] for col in READING_COLUMNS)
+    return None
+
+def get_reading_stats(device_id: int, start, end):
+    # db.get_reading_stats over hot and archived readings
+    if not touches_archive(start, end):
+        return get_hot_reading_stats(device_id, start, end)
+    df = read_readings(start, end, [device_id])
+    stats = {'readings': len(df)}
+    for metric in READING_COLUMNS[1:]:
+        stats[metric] = {
+            'avg': optional_float(df[metric].mean()),
+            'min': optional_float(df[metric].min()),
+            'max': optional_float(df[metric].max()),
+        }
+    return stats
+
+def get_energy_summary(start, end, unit_cost: float = 0.0, device_id: int = None, classroom_id: int = None,
+                       max_gap: int = ENERGY_MAX_GAP_SECONDS):
+    # db.get_energy_summary over hot and archived readings
+    if not touches_archive(start, end):
+        return get_hot_energy_summary(start, end, unit_cost, device_id, classroom_id, max_gap)
+    device_ids = None
+    if device_id is not None:
+        device_ids = [device_id]
+    elif classroom_id is not None:
+        device_ids = [row[0] for row in get_classroom_devices(classroom_id)]
+    df = read_readings(start, end, device_ids)
+    kwh = interval_energy(df, max_gap).dropna()
+    by_day = kwh.groupby(df.loc[kwh.index, 'timestamp'].dt.date).sum()
+    total_kwh = float(kwh.sum())
+    daily = [(day, float(value), float(value) * unit_cost) for day, value in by_day.items()]
+    return {'total_kwh': total_kwh, 'total_cost': total_kwh * unit_cost, 'daily': daily}
+
+def scan_archive(start, end, device_ids=None, max_gap=ENERGY_MAX_GAP_SECONDS, archive_dir=ARCHIVE_DIR):
+    # Per-device readings, average power and kWh over [start, end) from the
+    # Parquet files alone, one month in memory at a time. The last reading of
+    # each device is carried into the next month so no interval is lost.
+    totals = {}
+    carried = None
+    for month in months_between(start, end, archive_dir):
+        next_month = add_months(month, 1)
+        month_end = datetime(next_month.year, next_month.month, 1)
+        df = read_cold(max(datetime(month.year, month.month, 1), to_utc_naive(start)),
+                       min(month_end, to_utc_naive(end)), device_ids, archive_dir).to_pandas()
+        if df.empty:
+            continue
+        # A month re-archived after a failed commit holds some readings twice
+        df = df.drop_duplicates(['device_id', 'timestamp'], keep='last')
+        for device_id, group in df.groupby('device_id'):
+            entry = totals.setdefault(device_id, {'readings': 0, 'power_sum': 0.0, 'power_count': 0, 'kwh': 0.0})
+            entry['readings'] += len(group)
+            entry['power_sum'] += float(group['power'].sum())
+            entry['power_count'] += int(group['power'].count())
+        if carried is not None:
+            df = pd.concat([carried, df], ignore_index=True)
+        df = df.sort_values(['device_id', 'timestamp'], ignore_index=True)
+        kwh = interval_energy(df, max_gap)
+        for device_id, value in kwh.groupby(df['device_id']).sum().items():
+            totals[device_id]['kwh'] += float(value)
+        carried = df.groupby('device_id').tail(1)
+    return {
+        device_id: {'readings': entry['readings'], 'kwh': entry['kwh'],
+                    'avg_power': entry['power_sum'] / entry['power_count'] if entry['power_count'] else 0.0}
+        for device_id, entry in sorted(totals.items())
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Move closed months of energy readings to Parquet")
+    parser.add_argument("--keep-months", type=int, default=ARCHIVE_AFTER_MONTHS,
+                        help="closed months to keep in PostgreSQL; older ones are archived")
+    parser.add_argument("--month", help="archive a single month, e.g. 2025-01")
+    parser.add_argument("--scan", action="store_true", help="report per-device totals from the archive only")
+    parser.add_argument("--start", help="scan start (UTC), e.g. 2025-01-01")
+    parser.add_argument("--end", help="scan end (UTC), exclusive (default: now)")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    args = parser.parse_args()
+
+    if args.scan:
+        start = datetime.fromisoformat(args.start) if args.start else datetime(1970, 1, 1)
+        end = datetime.fromisoformat(args.end) if args.end else datetime.now(UTC).replace(tzinfo=None)
+        started = time.perf_counter()
+        totals = scan_archive(start, end, archive_dir=args.archive_dir)
+        for device_id, entry in totals.items():
+            print(f"device {device_id}: {entry['readings']} readings, "
+                  f"avg {entry['avg_power']:.1f} W, {entry['kwh']:.3f} kWh")
+        print(f"✅ Scanned {sum(e['readings'] for e in totals.values())} archived readings "
+              f"in {time.perf_counter() - started:.2f}s")
+    elif args.month:
+        archive_month(date.fromisoformat(f"{args.month}-01"), args.archive_dir)
+    elif args.keep_months > 0:
+        archived = archive_closed_months(args.keep_months, args.archive_dir)
+        print(f"✅ Archived {len(archived)} months")
+    else:
+        parser.error("pass --keep-months N (or set ARCHIVE_AFTER_MONTHS), --month or --scan")
@@ -0,0 +1,226 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime, UTC
+
+import aiohttp
+
+from collector import Collector
+from scheduler import scheduler, TokenBucket
+from spool import Spool
+from tuya_mock import MockTuyaServer, mock_device_id, MOCK_ACCESS_KEY
+from tuya_play import get_token, discover_datapoints
+
+# Fleet-scale ingest benchmark: runs the real collector against the local Tuya
+# simulator and prints one JSON line per fleet size, tagged with the current
+# commit so results can be compared across commits, e.g.
+#
+#   python bench.py --sizes 10,100,1000,5000 --latency-ms 80 >> bench_output.txt
+#
+# With --db, readings and status changes are written to the configured
+# PostgreSQL database (into a temporary classroom that is deleted afterwards);
+# otherwise the DB write is skipped and only polling is measured. With --spool,
+# readings are written to a temporary local spool first (as the collector does)
+# and draining it is timed separately.
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class BenchSink:
+    # Stands in for the ingest sink; times writes and the age of every row
+    # relative to the start of the poll cycle that produced it.
+
+    def __init__(self, write=None):
+        self.write = write
+        self.cycle_start = time.perf_counter()
+        self.latencies = []
+        self.rows = 0
+        self.write_seconds = 0.0
+
+    def __call__(self, rows):
+        started = time.perf_counter()
+        if self.write is not None:
+            self.write(rows)
+        done = time.perf_counter()
+        self.write_seconds += done - started
+        self.rows += len(rows)
+        self.latencies.extend([done - self.cycle_start] * len(rows))
+
+    def reset(self):
+        self.latencies = []
+        self.rows = 0
+        self.write_seconds = 0.0
+
+
+def memory_devices(size, projects, api_endpoint):
+    return [
+        (n + 1, f"bench-{n}", 0, f"bench-project-{n % projects}", MOCK_ACCESS_KEY,
+         mock_device_id(n), api_endpoint, "offline", "switch")
+        for n in range(size)
+    ]
+
+
+def create_db_devices(size, projects, api_endpoint):
+    from psycopg2.extras import execute_values
+    from db import add_classroom, get_all_classrooms, get_classroom_devices, get_connection
+
+    name = f"bench-{int(time.time())}"
+    add_classroom(name)
+    classroom_id = next(c[0] for c in get_all_classrooms() if c[1] == name)
+    with get_connection() as conn:
+        execute_values(conn.cursor(), '''
+            INSERT INTO devices (name, classroom_id, access_id, access_key, device_id, api_endpoint, status)
+            VALUES %s
+        ''', [(f"bench-{n}", classroom_id, f"bench-project-{n % projects}", MOCK_ACCESS_KEY,
+               mock_device_id(n), api_endpoint, "offline") for n in range(size)])
+    return classroom_id, get_classroom_devices(classroom_id)
+
+
+async def run_size(args, size):
+    server = MockTuyaServer(size, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                            error_rate=args.error_rate, throttle_rps=args.throttle_rps).start()
+    classroom_id = None
+    spool = None
+    try:
+        if args.db:
+            from db import insert_readings, update_device_statuses, save_device_states
+            classroom_id, rows = create_db_devices(size, args.projects, server.url)
+            write = insert_readings
+            update_statuses = update_device_statuses
+            save_states = save_device_states
+        else:
+            rows = memory_devices(size, args.projects, server.url)
+            write = None
+            update_statuses = lambda changes: None
+            save_states = lambda states: None
+        if args.spool:
+            # Measure the local spool as the sink; the DB write happens in drain() below
+            spool = Spool(os.path.join(tempfile.mkdtemp(), "bench_spool.db"), sink=write or (lambda rows: None))
+            write = spool.append
+        sink = BenchSink(write)
+
+        for access_id in {row[3] for row in rows}:
+            if args.rate_limit:
+                scheduler.buckets[access_id] = TokenBucket(args.rate_limit, args.rate_limit * 2)
+            else:
+                scheduler.buckets[access_id] = TokenBucket(1e9, 1e9, 0)
+
+        # All simulated plugs share one data-point model, so discover it once
+        token_info = get_token(rows[0][3], MOCK_ACCESS_KEY, server.url)
+        datapoints = discover_datapoints(rows[0][5], rows[0][3], MOCK_ACCESS_KEY, server.url, token_info)
+        known_datapoints = {row[0]: datapoints for row in rows}
+
+        # Readings go to the sink per polled batch, as in the collector service
+        collector = Collector(load_devices=lambda: rows, insert=sink, update_statuses=update_statuses,
+                              load_datapoints=lambda: dict(known_datapoints),
+                              save_datapoints=lambda *a: None, save_states=save_states,
+                              concurrency=args.concurrency)
+
+        cycle_seconds = []
+        connector = aiohttp.TCPConnector(limit=args.concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            # Warm-up cycle: tokens, connections and status cache
+            await collector.poll_once(session, semaphore)
+            sink.reset()
+            server.cloud.reset_counts()
+
+            for _ in range(args.cycles):
+                sink.cycle_start = time.perf_counter()
+                await collector.poll_once(session, semaphore)
+                cycle_seconds.append(time.perf_counter() - sink.cycle_start)
+
+        drain_seconds = None
+        if spool is not None:
+            started = time.perf_counter()
+            spool.drain()
+            drain_seconds = time.perf_counter() - started
+
+        polls = size * args.cycles
+        return {
+            "commit": git_commit(),
+            "timestamp": datetime.now(UTC).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "devices": size,
+            "projects": args.projects,
+            "cycles": args.cycles,
+            "concurrency": args.concurrency,
+            "mock_latency_ms": args.latency_ms,
+            "mock_error_rate": args.error_rate,
+            "mock_throttle_rps": args.throttle_rps,
+            "requests_per_cycle": round(sum(server.cloud.request_counts.values()) / args.cycles, 1),
+            "polls_per_sec": round(polls / sum(cycle_seconds), 1),
+            "cycle_p50_s": round(percentile(cycle_seconds, 0.5), 3),
+            "reading_latency_p50_ms": round(percentile(sink.latencies, 0.5) * 1000, 1) if sink.latencies else None,
+            "reading_latency_p95_ms": round(percentile(sink.latencies, 0.95) * 1000, 1) if sink.latencies else None,
+            "readings": sink.rows,
+            "failed_polls": polls - sink.rows,
+            "db_rows_per_sec": db_rows_per_sec(args, sink, drain_seconds),
+            "spool": args.spool,
+            "spool_append_rows_per_sec": round(sink.rows / sink.write_seconds, 1) if spool and sink.write_seconds else None,
+            "db_pool": pool_metrics() if args.db else None,
+        }
+    finally:
+        server.stop()
+        if spool is not None:
+            spool.close()
+            shutil.rmtree(os.path.dirname(spool.path), ignore_errors=True)
+        if classroom_id is not None:
+            from db import delete_classroom
+            delete_classroom(classroom_id)
+
+
+def db_rows_per_sec(args, sink, drain_seconds):
+    if not args.db:
+        return None
+    seconds = drain_seconds if args.spool else sink.write_seconds
+    return round(sink.rows / seconds, 1) if seconds else None
+
+
+def pool_metrics():
+    from db import get_pool_metrics
+    metrics = get_pool_metrics()
+    return {key: round(value, 4) if isinstance(value, float) else value for key, value in metrics.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collector ingest benchmark against the Tuya simulator")
+    parser.add_argument("--sizes", default="10,100,1000,5000", help="comma separated fleet sizes")
+    parser.add_argument("--cycles", type=int, default=3, help="measured poll cycles per size")
+    parser.add_argument("--projects", type=int, default=1, help="cloud projects the fleet is spread over")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=50, help="simulated Tuya response latency")
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rps", type=float, default=0, help="simulated Tuya quota (0 = unlimited)")
+    parser.add_argument("--rate-limit", type=float, default=0,
+                        help="client-side requests/s per project (0 = scheduler disabled)")
+    parser.add_argument("--db", action="store_true", help="write readings to the configured database")
+    parser.add_argument("--spool", action="store_true",
+                        help="write readings to a temporary local spool and time draining it separately")
+    args = parser.parse_args()
+
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        print(json.dumps(asyncio.run(run_size(args, size))), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+import asyncio
+import math
+import os
+import signal
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, UTC
+
+import aiohttp
+
+from archive import archive_closed_months
+from db import (migrate, get_all_devices, insert_readings, update_device_statuses,
+                get_all_device_datapoints, save_device_datapoints, save_device_states,
+                maintain_energy_usage, refresh_rollups)
+from spool import Spool
+from scheduler import PRIORITY_BACKGROUND
+from tuya_play import (get_token, async_get_device_snapshots, async_discover_datapoints, token_manager,
+                       TOKEN_INVALID_CODE, CONNECT_TIMEOUT, READ_TIMEOUT)
+
+POLL_INTERVAL = int(os.getenv("POLL_INTERVAL_SECONDS", 60))
+POLL_CONCURRENCY = int(os.getenv("POLL_CONCURRENCY", 50))
+DISCOVERY_RETRY_SECONDS = int(os.getenv("DISCOVERY_RETRY_SECONDS", 3600))
+DISCOVERY_BATCH_SIZE = int(os.getenv("DISCOVERY_BATCH_SIZE", 100))  # per project and cycle
+MAINTENANCE_INTERVAL = int(os.getenv("MAINTENANCE_INTERVAL_SECONDS", 86400))
+MAX_CONSECUTIVE_FAILURES = 3
+
+
+def device_info_from_row(device):
+    return {
+        'id': device[0],
+        'name': device[1],
+        'classroom_id': device[2],
+        'access_id': device[3],
+        'access_key': device[4],
+        'device_id': device[5],
+        'api_endpoint': device[6],
+        'status': device[7],
+        'switch_code': device[8] or 'switch'
+    }
+
+
+def group_by_project(devices):
+    # Devices sharing a cloud project (same endpoint and access id) can share
+    # a token and be fetched through the batch status endpoint together.
+    groups = defaultdict(list)
+    for device_info in devices:
+        groups[(device_info['api_endpoint'], device_info['access_id'])].append(device_info)
+    return groups
+
+
+def next_boundary(now, interval):
+    # Start of the next interval slot, so cycles stay aligned to wall-clock
+    # boundaries (e.g. every whole minute) instead of drifting by the poll time.
+    return (math.floor(now / interval) + 1) * interval
+
+
+class Collector:
+    # Polls every device from a single asyncio event loop. HTTP requests share
+    # one aiohttp session and are bounded by `concurrency`; blocking DB writes
+    # run in worker threads so they never stall the loop. The last known status
+    # of each device is kept in memory and only transitions are written back,
+    # once per cycle; the live state (switch, metrics, last seen, failures) of
+    # every polled device is written in one batch per cycle for the UI. New
+    # devices get a one-time data-point discovery whose result is stored in
+    # the DB and used for every later poll. `refresh`, if
+    # given, runs after every cycle (rollups); `maintain` runs at startup and
+    # then every MAINTENANCE_INTERVAL seconds. `insert` gets the readings of
+    # each polled batch as one list of (device_id, ts, power, voltage, current).
+
+    def __init__(self, load_devices=get_all_devices, insert=insert_readings,
+                 update_statuses=update_device_statuses, load_datapoints=get_all_device_datapoints,
+                 save_datapoints=save_device_datapoints, save_states=save_device_states, refresh=None,
+                 maintain=None, interval=POLL_INTERVAL, concurrency=POLL_CONCURRENCY):
+        self.load_devices = load_devices
+        self.insert = insert
+        self.update_statuses = update_statuses
+        self.load_datapoints = load_datapoints
+        self.save_datapoints = save_datapoints
+        self.save_states = save_states
+        self.refresh = refresh
+        self.maintain = maintain
+        self.last_maintenance = 0.0
+        self.interval = interval
+        self.concurrency = concurrency
+        self.failures = {}
+        self.statuses = {}
+        self.status_changes = {}
+        self.states = {}
+        self._status_lock = threading.Lock()
+        self.datapoints = None
+        self.discovery_attempts = {}
+
+    def set_status(self, device_id, status, ts):
+        with self._status_lock:
+            if self.statuses.get(device_id) != status:
+                self.statuses[device_id] = status
+                self.status_changes[device_id] = (device_id, status, ts)
+
+    def flush_status_changes(self):
+        with self._status_lock:
+            changes = list(self.status_changes.values())
+            self.status_changes = {}
+        if not changes:
+            return
+        try:
+            self.update_statuses(changes)
+        except Exception as e:
+            print(f"Error writing {len(changes)} status changes: {e}")
+            with self._status_lock:
+                for change in changes:
+                    self.status_changes.setdefault(change[0], change)
+
+    def set_state(self, device_id, switch, power, voltage, current, ts):
+        seen = switch is not None or power is not None or voltage is not None or current is not None
+        with self._status_lock:
+            self.states[device_id] = (device_id, switch, power, voltage, current, ts if seen else None,
+                                      self.failures.get(device_id, 0), ts)
+
+    def flush_states(self):
+        with self._status_lock:
+            states = list(self.states.values())
+            self.states = {}
+        try:
+            self.save_states(states)
+        except Exception as e:
+            print(f"Error writing {len(states)} device states: {e}")
+
+    def record_failure(self, device_info, ts):
+        device_id = device_info['id']
+        self.failures[device_id] = self.failures.get(device_id, 0) + 1
+        if self.failures[device_id] > MAX_CONSECUTIVE_FAILURES:
+            self.set_status(device_id, "offline", ts)
+
+    def record(self, device_info, snapshot, ts):
+        device_id = device_info['id']
+
+        switch_status = snapshot['switch']
+        if switch_status is None:
+            self.record_failure(device_info, ts)
+        else:
+            self.set_status(device_id, "on" if switch_status else "off", ts)
+            self.failures[device_id] = 0
+
+        power, voltage, current = (
+            float(value) if value is not None else None
+            for value in (snapshot['power'], snapshot['voltage'], snapshot['current'])
+        )
+        self.set_state(device_id, None if switch_status is None else bool(switch_status), power, voltage,
+                       current, ts)
+        if power is not None or voltage is not None or current is not None:
+            return (device_id, ts, power, voltage, current)
+        return None
+
+    def record_all(self, devices, snapshots, ts):
+        # The batch's readings are handed to `insert` in one call
+        readings = []
+        for device_info in devices:
+            try:
+                if snapshots is None:
+                    self.record_failure(device_info, ts)
+                    self.set_state(device_info['id'], None, None, None, None, ts)
+                else:
+                    reading = self.record(device_info, snapshots[device_info['device_id']], ts)
+                    if reading is not None:
+                        readings.append(reading)
+            except Exception as e:
+                print(f"Polling error for device {device_info['name']}: {e}")
+        if readings:
+            try:
+                self.insert(readings)
+            except Exception as e:
+                print(f"Error writing {len(readings)} readings: {e}")
+
+    async def discover(self, session, semaphore, devices, token_info):
+        first = devices[0]
+        results = await asyncio.gather(*(
+            async_discover_datapoints(session, d['device_id'], first['access_id'], first['access_key'],
+                                      first['api_endpoint'], token_info, semaphore)
+            for d in devices
+        ), return_exceptions=True)
+
+        for device_info, datapoints in zip(devices, results):
+            self.discovery_attempts[device_info['id']] = time.time()
+            if isinstance(datapoints, Exception):
+                print(f"Data point discovery failed for {device_info['name']}: {datapoints}")
+                continue
+            if datapoints is None:
+                continue
+            try:
+                await asyncio.to_thread(self.save_datapoints, device_info['id'], datapoints)
+            except Exception as e:
+                print(f"Error saving data points for {device_info['name']}: {e}")
+                continue
+            self.datapoints[device_info['id']] = datapoints
+            if datapoints['switch_code']:
+                device_info['switch_code'] = datapoints['switch_code']
+
+    async def poll_project(self, session, semaphore, devices, ts):
+        first = devices[0]
+        access_id, access_key, api_endpoint = first['access_id'], first['access_key'], first['api_endpoint']
+
+        snapshots = None
+        try:
+            token_info = await asyncio.to_thread(get_token, access_id, access_key, api_endpoint,
+                                                 PRIORITY_BACKGROUND)
+            if token_info is not None:
+                now = time.time()
+                undiscovered = [
+                    d for d in devices
+                    if d['id'] not in self.datapoints
+                    and now - self.discovery_attempts.get(d['id'], 0) > DISCOVERY_RETRY_SECONDS
+                ]
+                if undiscovered:
+                    await self.discover(session, semaphore, undiscovered[:DISCOVERY_BATCH_SIZE], token_info)
+
+                device_ids = list(dict.fromkeys(d['device_id'] for d in devices))
+                switch_codes = {d['device_id']: d['switch_code'] for d in devices}
+                datapoints = {d['device_id']: self.datapoints[d['id']] for d in devices if d['id'] in self.datapoints}
+                snapshots = await async_get_device_snapshots(
+                    session, device_ids, access_id, access_key, api_endpoint, token_info,
+                    switch_codes, semaphore=semaphore, datapoints=datapoints
+                )
+                if any(s['code'] == TOKEN_INVALID_CODE for s in snapshots.values()):
+                    token_manager.invalidate(access_id, api_endpoint)
+        except Exception as e:
+            print(f"Polling error for project {access_id}: {e}")
+
+        await asyncio.to_thread(self.record_all, devices, snapshots, ts)
+
+    async def poll_once(self, session, semaphore):
+        rows = await asyncio.to_thread(self.load_devices)
+        devices = [device_info_from_row(row) for row in rows]
+        if self.datapoints is None:
+            self.datapoints = await asyncio.to_thread(self.load_datapoints)
+
+        known = {d['id'] for d in devices}
+        for device_id in list(self.failures):
+            if device_id not in known:
+                del self.failures[device_id]
+        for device_id in list(self.datapoints):
+            if device_id not in known:
+                del self.datapoints[device_id]
+                self.discovery_attempts.pop(device_id, None)
+        with self._status_lock:
+            for device_id in list(self.statuses):
+                if device_id not in known:
+                    del self.statuses[device_id]
+                    self.status_changes.pop(device_id, None)
+            for device_info in devices:
+                self.statuses.setdefault(device_info['id'], device_info['status'])
+
+        ts = datetime.now(UTC).strftime("%Y-%m-%d %H:%M:%S")
+        await asyncio.gather(*(
+            self.poll_project(session, semaphore, project_devices, ts)
+            for project_devices in group_by_project(devices).values()
+        ))
+        await asyncio.to_thread(self.flush_status_changes)
+        await asyncio.to_thread(self.flush_states)
+
+    async def run_refresh(self):
+        if self.refresh is None:
+            return
+        try:
+            await asyncio.to_thread(self.refresh)
+        except Exception as e:
+            print(f"Rollup refresh failed: {e}")
+
+    async def run_maintenance(self):
+        if self.maintain is None or time.time() - self.last_maintenance < MAINTENANCE_INTERVAL:
+            return
+        self.last_maintenance = time.time()
+        try:
+            await asyncio.to_thread(self.maintain)
+        except Exception as e:
+            print(f"Maintenance failed: {e}")
+
+    async def run_async(self, stop_event=None):
+        stop_event = stop_event or threading.Event()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=max(self.interval * 2, 30))
+        timeout = aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            while not stop_event.is_set():
+                try:
+                    await self.poll_once(session, semaphore)
+                except Exception as e:
+                    print(f"Polling cycle failed: {e}")
+                await self.run_refresh()
+                await self.run_maintenance()
+
+                deadline = next_boundary(time.time(), self.interval)
+                while not stop_event.is_set() and time.time() < deadline:
+                    await asyncio.sleep(min(1.0, deadline - time.time()))
+
+    def run(self, stop_event=None):
+        asyncio.run(self.run_async(stop_event))
+
+
+def maintain():
+    # Archive first, so retention never drops a month that should have been archived
+    archive_closed_months()
+    maintain_energy_usage()
+
+
+def main():
+    migrate()
+
+    stop_event = threading.Event()
+
+    def handle_signal(signum, frame):
+        print(f"🛑 Received {signal.Signals(signum).name}, finishing current cycle...")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    # Each batch's readings are committed to the local spool as soon as they
+    # are polled and reach PostgreSQL through its drainer, so a database
+    # outage or a crash delays them instead of losing them
+    spool = Spool().start()
+    pending = spool.pending()
+    if pending:
+        print(f"📦 Replaying {pending} spooled readings from a previous run")
+
+    print(f"🚀 Collector started (interval {POLL_INTERVAL}s, concurrency {POLL_CONCURRENCY})")
+    try:
+        Collector(insert=spool.append, refresh=refresh_rollups, maintain=maintain).run(stop_event)
+    finally:
+        spool.close()
+    print(f"✅ Collector stopped ({spool.stats['appended']} readings spooled, {spool.stats['drained']} written)")
+
+
+if __name__ == '__main__':
+    main()
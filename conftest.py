@@ -0,0 +1,23 @@
+import os
+
+import pytest
+
+import db
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+
+@pytest.fixture
+def database(monkeypatch):
+    # Empty, migrated database for tests that need PostgreSQL itself. Skipped
+    # unless TEST_DATABASE_URL is set; its data is deleted, so never point it
+    # at a real database.
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    test_pool = db.ConnectionPool(TEST_DATABASE_URL, minconn=1, maxconn=2)
+    monkeypatch.setattr(db, 'connection_pool', test_pool)
+    db.migrate()
+    with db.get_connection() as conn:
+        conn.cursor().execute('TRUNCATE classrooms RESTART IDENTITY CASCADE')
+    yield
+    test_pool.closeall()
@@ -0,0 +1,196 @@
+import argparse
+import io
+import os
+import sys
+from datetime import datetime, timedelta, UTC
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from archive import months_between, read_cold
+from db import get_connection, to_utc_naive, add_months
+
+# Streaming export of energy readings for one device, one classroom or the
+# whole building. CSV goes straight from PostgreSQL's COPY ... TO STDOUT into
+# the output file; Parquet is written chunk by chunk from a server-side cursor.
+# Either way only one chunk is held in memory, whatever the size of the range,
+# and the export runs without the pool's statement timeout. Months that were
+# moved to the Parquet archive are read from there, a month at a time, and
+# written before the readings still in PostgreSQL.
+# Nightly archival example (yesterday, whole building, 15-minute averages):
+#
+#   python export.py --format parquet --resample "15 minutes" -o fub_$(date +%F).parquet
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", 50000))
+EXPORT_FORMATS = ('csv', 'parquet')
+EXPORT_COLUMNS = ('timestamp', 'classroom', 'device', 'power', 'voltage', 'current')
+
+PARQUET_SCHEMA = pa.schema([
+    ('timestamp', pa.timestamp('us')),
+    ('classroom', pa.string()),
+    ('device', pa.string()),
+    ('power', pa.float64()),
+    ('voltage', pa.float64()),
+    ('current', pa.float64()),
+])
+
+
+def export_query(start, end, device_id=None, classroom_id=None, resample=None):
+    # (sql, params) selecting EXPORT_COLUMNS for the scope, ordered per device.
+    # With `resample` (a PostgreSQL interval such as '15 minutes') readings are
+    # averaged into buckets aligned to midnight UTC.
+    if resample:
+        timestamp = "date_bin(%(resample)s::interval, e.timestamp, TIMESTAMP '2000-01-01')"
+        metrics = "AVG(e.power) AS power, AVG(e.voltage) AS voltage, AVG(e.current) AS current"
+        group_by = "GROUP BY 1, c.name, d.name, d.id"
+    else:
+        timestamp = "e.timestamp"
+        metrics = "e.power, e.voltage, e.current"
+        group_by = ""
+
+    sql = f'''
+        SELECT {timestamp} AS timestamp, c.name AS classroom, d.name AS device, {metrics}
+        FROM energy_usage e
+        JOIN devices d ON d.id = e.device_id
+        JOIN classrooms c ON c.id = d.classroom_id
+        WHERE e.timestamp >= %(start)s AND e.timestamp < %(end)s
+        AND (%(device_id)s::integer IS NULL OR e.device_id = %(device_id)s)
+        AND (%(classroom_id)s::integer IS NULL OR d.classroom_id = %(classroom_id)s)
+        {group_by}
+        ORDER BY c.name, d.name, d.id, 1
+    '''
+    params = {'start': to_utc_naive(start), 'end': to_utc_naive(end), 'device_id': device_id,
+              'classroom_id': classroom_id, 'resample': resample}
+    return sql, params
+
+
+def export_devices(device_id=None, classroom_id=None):
+    # {device id: (classroom name, device name)} of the devices in scope
+    with get_connection() as conn:
+        c = conn.cursor()
+
+        c.execute('''
+            SELECT d.id, c.name, d.name
+            FROM devices d
+            JOIN classrooms c ON c.id = d.classroom_id
+            WHERE (%(device_id)s::integer IS NULL OR d.id = %(device_id)s)
+            AND (%(classroom_id)s::integer IS NULL OR d.classroom_id = %(classroom_id)s)
+        ''', {'device_id': device_id, 'classroom_id': classroom_id})
+        return {row[0]: row[1:] for row in c.fetchall()}
+
+
+def archived_frames(start, end, device_id=None, classroom_id=None, resample=None):
+    # Archived readings in scope as DataFrames with EXPORT_COLUMNS, one month
+    # at a time, ordered like export_query. Resampling floors to the interval,
+    # which matches date_bin for intervals that divide a day.
+    start, end = to_utc_naive(start), to_utc_naive(end)
+    months = months_between(start, end)
+    if not months:
+        return
+    devices = export_devices(device_id, classroom_id)
+    names = pd.DataFrame.from_dict(devices, orient='index', columns=['classroom', 'device'])
+    for month in months:
+        next_month = add_months(month, 1)
+        df = read_cold(max(start, datetime(month.year, month.month, 1)),
+                       min(end, datetime(next_month.year, next_month.month, 1)), list(devices)).to_pandas()
+        if df.empty:
+            continue
+        if resample:
+            df['timestamp'] = df['timestamp'].dt.floor(pd.Timedelta(resample))
+            df = df.groupby(['device_id', 'timestamp'], as_index=False)[['power', 'voltage', 'current']].mean()
+        df = df.join(names, on='device_id').sort_values(['classroom', 'device', 'device_id', 'timestamp'])
+        yield df[list(EXPORT_COLUMNS)]
+
+
+def csv_float(value):
+    # Shortest round-trip form without a trailing ".0", as PostgreSQL prints it
+    text = repr(float(value))
+    return text[:-2] if text.endswith('.0') else text
+
+
+def export_csv(out, sql, params, archived=()):
+    rows = 0
+    for df in archived:
+        text = df.to_csv(header=rows == 0, index=False, date_format='%Y-%m-%d %H:%M:%S', float_format=csv_float)
+        out.write(text if isinstance(out, io.TextIOBase) else text.encode('utf8'))
+        rows += len(df)
+    with get_connection(statement_timeout=0) as conn:
+        c = conn.cursor()
+        query = c.mogrify(sql, params).decode('utf8')
+        header = ", HEADER" if rows == 0 else ""
+        c.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv{header})", out)
+        return rows + c.rowcount
+
+
+def export_parquet(out, sql, params, archived=(), chunk_rows=EXPORT_CHUNK_ROWS):
+    rows = 0
+    with get_connection(statement_timeout=0) as conn:
+        # Named cursor: rows stay on the server until fetched
+        c = conn.cursor(name='energy_export')
+        c.itersize = chunk_rows
+        c.execute(sql, params)
+        with pq.ParquetWriter(out, PARQUET_SCHEMA, compression='zstd') as writer:
+            for df in archived:
+                writer.write_table(pa.Table.from_pandas(df, schema=PARQUET_SCHEMA, preserve_index=False))
+                rows += len(df)
+            while True:
+                chunk = c.fetchmany(chunk_rows)
+                if not chunk:
+                    break
+                columns = list(zip(*chunk))
+                writer.write_table(pa.table(
+                    {name: pa.array(values, type=PARQUET_SCHEMA.field(name).type)
+                     for name, values in zip(EXPORT_COLUMNS, columns)},
+                    schema=PARQUET_SCHEMA
+                ))
+                rows += len(chunk)
+        c.close()
+    return rows
+
+
+def export_readings(out, start, end, fmt='csv', device_id=None, classroom_id=None, resample=None):
+    # Writes readings in [start, end) to `out` (a path or binary file object;
+    # CSV also accepts a text file object) and returns the number of rows.
+    # No device_id/classroom_id means the whole building.
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    sql, params = export_query(start, end, device_id, classroom_id, resample)
+    archived = archived_frames(start, end, device_id, classroom_id, resample)
+
+    if fmt == 'parquet':
+        return export_parquet(out, sql, params, archived)
+    if isinstance(out, (str, os.PathLike)):
+        with open(out, 'wb') as f:
+            return export_csv(f, sql, params, archived)
+    return export_csv(out, sql, params, archived)
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value).replace(tzinfo=UTC) if value else None
+
+
+if __name__ == '__main__':
+    today = datetime.now(UTC).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    parser = argparse.ArgumentParser(description="Export energy readings as CSV or Parquet")
+    parser.add_argument("--device-id", type=int, help="database id of a single device")
+    parser.add_argument("--classroom-id", type=int, help="database id of a classroom")
+    parser.add_argument("--start", help="UTC start, e.g. 2025-01-01 or '2025-01-01 06:00' (default: yesterday)")
+    parser.add_argument("--end", help="UTC end, exclusive (default: today 00:00)")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default='csv')
+    parser.add_argument("--resample", help="average into buckets, e.g. '1 minute', '15 minutes', '1 hour'")
+    parser.add_argument("-o", "--output", default='-', help="output file ('-' = stdout, CSV only)")
+    args = parser.parse_args()
+
+    start = parse_time(args.start) or today - timedelta(days=1)
+    end = parse_time(args.end) or today
+    if args.output == '-':
+        if args.format != 'csv':
+            parser.error("Parquet output needs --output")
+        out = sys.stdout.buffer
+    else:
+        out = args.output
+
+    rows = export_readings(out, start, end, args.format, args.device_id, args.classroom_id, args.resample)
+    print(f"✅ Exported {rows} rows ({start:%Y-%m-%d %H:%M} .. {end:%Y-%m-%d %H:%M} UTC)", file=sys.stderr)
@@ -0,0 +1,111 @@
+import os
+import select
+import threading
+from urllib.parse import urlsplit
+
+import psycopg2
+import psycopg2.extensions
+
+from db import DATABASE_URL, LIVE_CHANNEL, STATE_CHANNEL
+
+LIVE_CHECK_SECONDS = float(os.getenv("LIVE_CHECK_SECONDS", 1))  # how often live fragments look for news
+LIVE_MAX_STALE_SECONDS = float(os.getenv("LIVE_MAX_STALE_SECONDS", 60))  # reload anyway after this long
+LISTEN_RECONNECT_SECONDS = float(os.getenv("LISTEN_RECONNECT_SECONDS", 5))
+
+
+def direct_database_url(url):
+    # Neon's pooled host is the direct one with "-pooler" after the endpoint id,
+    # e.g. ep-name-123-pooler.region.aws.neon.tech; other URLs are returned as is
+    host = urlsplit(url).hostname if url and '://' in url else None
+    endpoint, dot, domain = (host or '').partition('.')
+    if not endpoint.endswith('-pooler'):
+        return url
+    scheme, _, rest = url.partition('://')
+    userinfo, at, location = rest.rpartition('@')
+    location = location.replace(host, endpoint[:-len('-pooler')] + dot + domain, 1)
+    return f"{scheme}://{userinfo}{at}{location}"
+
+
+# LISTEN needs a session of its own: behind a transaction-mode pooler (Neon's
+# -pooler host) notifications never arrive, so by default the direct host of
+# DATABASE_URL is used
+LISTEN_DATABASE_URL = os.getenv("LISTEN_DATABASE_URL") or direct_database_url(DATABASE_URL)
+if not os.getenv("LISTEN_DATABASE_URL") and LISTEN_DATABASE_URL != DATABASE_URL:
+    print(f"ℹ️ Live updates LISTEN on the direct host {urlsplit(LISTEN_DATABASE_URL).hostname} "
+          f"(set LISTEN_DATABASE_URL to override)")
+
+
+class ReadingListener:
+    # One LISTEN connection per app process, shared by every session. The
+    # ingest path NOTIFYs LIVE_CHANNEL with the ids of the devices that got
+    # new readings and STATE_CHANNEL with those whose switch or failures
+    # changed; each id bumps that device's version counter for the channel.
+    # Dashboards compare versions and only query the database when their
+    # device changed, so an idle dashboard costs no queries and a switch
+    # toggle does not reload the charts. The connection is held open forever
+    # and therefore not taken from the pool.
+
+    def __init__(self, dsn=LISTEN_DATABASE_URL, channels=(LIVE_CHANNEL, STATE_CHANNEL)):
+        self.dsn = dsn
+        self.channels = channels
+        self.versions = {channel: {} for channel in channels}
+        # Bumped on every (re)connect: notifications sent while disconnected
+        # are lost, so every device counts as changed
+        self.epoch = 0
+        self.connected = False
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="reading-listener", daemon=True)
+        self._thread.start()
+        return self
+
+    def version(self, device_id, channel=LIVE_CHANNEL):
+        with self._lock:
+            return self.epoch, self.versions[channel].get(device_id, 0)
+
+    def _handle(self, channel, payload):
+        versions = self.versions.get(channel)
+        if versions is None:
+            return
+        device_ids = [int(value) for value in payload.split(',') if value.strip().isdigit()]
+        with self._lock:
+            for device_id in device_ids:
+                versions[device_id] = versions.get(device_id, 0) + 1
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn, keepalives=1, keepalives_idle=30)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as c:
+                    for channel in self.channels:
+                        c.execute(f'LISTEN {channel}')
+                with self._lock:
+                    self.epoch += 1
+                    self.connected = True
+
+                while not self._stop_event.is_set():
+                    # Wake up now and then to notice stop(); otherwise sleep in select()
+                    if select.select([conn], [], [], LISTEN_RECONNECT_SECONDS) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self._handle(notify.channel, notify.payload)
+            except Exception as e:
+                print(f"Live listener disconnected: {e}")
+            finally:
+                with self._lock:
+                    self.connected = False
+                if conn is not None:
+                    conn.close()
+            self._stop_event.wait(LISTEN_RECONNECT_SECONDS)
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(LISTEN_RECONNECT_SECONDS + 1)
@@ -0,0 +1,186 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, UTC
+
+import numpy as np
+
+from db import fetch_since, to_utc_naive, READING_COLUMNS, FETCH_MAX_POINTS, ROLLUP_RANGE_DAYS
+
+READING_CACHE_MAX_ROWS = int(os.getenv("READING_CACHE_MAX_ROWS", 1000000))  # across all devices
+# Longer ranges are charted from the rollups, so the cache only has to cover
+# ROLLUP_RANGE_DAYS; the extra day keeps a range ending a little before now inside it
+READING_CACHE_DAYS = float(os.getenv("READING_CACHE_DAYS", ROLLUP_RANGE_DAYS + 1))
+READING_CACHE_OVERLAP_SECONDS = int(os.getenv("READING_CACHE_OVERLAP_SECONDS", 30))
+
+
+class CachedReadings:
+    # Immutable snapshot of one device's readings since `window_start`, as
+    # numpy columns sorted by timestamp (datetime64[us], naive UTC). Refreshes
+    # build a new snapshot, so readers never see a half-updated one.
+
+    def __init__(self, window_start, columns, high_water=None):
+        self.window_start = window_start
+        self.columns = columns
+        self.high_water = high_water
+
+    def __len__(self):
+        return len(self.columns['timestamp'])
+
+    def covers(self, start):
+        return to_utc_naive(start) >= self.window_start
+
+    def _slice(self, start, end):
+        timestamps = self.columns['timestamp']
+        lo = 0 if start is None else np.searchsorted(timestamps, np.datetime64(to_utc_naive(start), 'us'))
+        hi = len(timestamps) if end is None else np.searchsorted(timestamps, np.datetime64(to_utc_naive(end), 'us'))
+        return {col: values[lo:hi] for col, values in self.columns.items()}
+
+    def fetch_range(self, start, end, max_points: int = FETCH_MAX_POINTS):
+        # Same result as db.fetch_range (numpy columns instead of lists)
+        columns = self._slice(start, end)
+        if len(columns['timestamp']) <= max_points:
+            return columns
+        start, end = to_utc_naive(start), to_utc_naive(end)
+        origin = np.datetime64(start, 'us')
+        width = np.timedelta64(round(max((end - start).total_seconds() / max_points, 1) * 1e6), 'us')
+        buckets, index = np.unique((columns['timestamp'] - origin) // width, return_inverse=True)
+        points = {'timestamp': origin + buckets * width}
+        for metric in READING_COLUMNS[1:]:
+            values = columns[metric]
+            valid = ~np.isnan(values)
+            sums = np.bincount(index[valid], weights=values[valid], minlength=len(buckets))
+            counts = np.bincount(index[valid], minlength=len(buckets))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                points[metric] = np.where(counts > 0, sums / counts, np.nan)
+        return points
+
+    def latest(self, before=None):
+        # (timestamp, power, voltage, current) like db.get_latest_reading, or None
+        columns = self._slice(None, before)
+        if not len(columns['timestamp']):
+            return None
+        row = [columns[col][-1] for col in READING_COLUMNS]
+        return (row[0].astype(datetime), *(None if np.isnan(v) else float(v) for v in row[1:]))
+
+    def stats(self, start, end):
+        # Same result as db.get_reading_stats
+        columns = self._slice(start, end)
+        stats = {'readings': len(columns['timestamp'])}
+        for metric in READING_COLUMNS[1:]:
+            values = columns[metric][~np.isnan(columns[metric])]
+            if len(values):
+                stats[metric] = {'avg': float(values.mean()), 'min': float(values.min()), 'max': float(values.max())}
+            else:
+                stats[metric] = {'avg': None, 'min': None, 'max': None}
+        return stats
+
+
+def to_columns(rows):
+    # fetch_since rows -> numpy columns (None becomes NaN)
+    if not rows:
+        return empty_columns()
+    values = list(zip(*rows))
+    columns = {'timestamp': np.array(values[0], dtype='datetime64[us]')}
+    for i, metric in enumerate(READING_COLUMNS[1:], start=1):
+        columns[metric] = np.array(values[i], dtype=np.float64)
+    return columns
+
+def empty_columns():
+    columns = {'timestamp': np.array([], dtype='datetime64[us]')}
+    columns.update({metric: np.array([], dtype=np.float64) for metric in READING_COLUMNS[1:]})
+    return columns
+
+def merge_columns(old, new):
+    # Appends `new` to `old`. Late or rewritten readings (timestamps not after
+    # the last cached one) are merged in order, the newer row winning.
+    if not len(new['timestamp']):
+        return old
+    if not len(old['timestamp']) or new['timestamp'][0] > old['timestamp'][-1]:
+        return {col: np.concatenate([old[col], new[col]]) for col in old}
+    merged = {col: np.concatenate([old[col], new[col]]) for col in old}
+    order = np.argsort(merged['timestamp'], kind='stable')
+    merged = {col: values[order] for col, values in merged.items()}
+    timestamps = merged['timestamp']
+    keep = np.append(timestamps[1:] != timestamps[:-1], True)
+    return {col: values[keep] for col, values in merged.items()}
+
+
+class ReadingCache:
+    # Per-device reading cache shared by all dashboard sessions. get()
+    # fetches only the rows written since the device's high-water mark
+    # (ingested_at, so late and rewritten readings are caught too), appends
+    # them and drops rows that left the window; the cost of a refresh follows
+    # the new data, not the history. Entries are evicted least recently used
+    # once the cache holds more than `max_rows` readings.
+
+    def __init__(self, max_rows=READING_CACHE_MAX_ROWS, days=READING_CACHE_DAYS, fetch=fetch_since,
+                 overlap=READING_CACHE_OVERLAP_SECONDS):
+        self.max_rows = max_rows
+        self.window = timedelta(days=days)
+        self.fetch = fetch
+        self.overlap = timedelta(seconds=overlap)
+        self.entries = OrderedDict()
+        self.stats = {'loads': 0, 'refreshes': 0, 'fetched_rows': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        self._device_locks = {}
+
+    def rows(self):
+        with self._lock:
+            return sum(len(entry) for entry in self.entries.values())
+
+    def get(self, device_id):
+        with self._lock:
+            device_lock = self._device_locks.setdefault(device_id, threading.Lock())
+        # One refresh per device at a time; other sessions wait and reuse it
+        with device_lock:
+            with self._lock:
+                entry = self.entries.get(device_id)
+            window_start = datetime.now(UTC).replace(tzinfo=None) - self.window
+
+            if entry is None or entry.high_water is None:
+                self.stats['loads'] += 1
+                rows = self.fetch(device_id, None, window_start)
+                columns = to_columns(rows)
+            else:
+                self.stats['refreshes'] += 1
+                rows = self.fetch(device_id, entry.high_water - self.overlap, window_start)
+                columns = merge_columns(entry.columns, to_columns(rows))
+            self.stats['fetched_rows'] += len(rows)
+
+            high_water = entry.high_water if entry is not None else None
+            if rows:
+                newest = max(row[4] for row in rows)
+                high_water = newest if high_water is None else max(high_water, newest)
+            cut = np.searchsorted(columns['timestamp'], np.datetime64(window_start, 'us'))
+            if cut:
+                columns = {col: values[cut:] for col, values in columns.items()}
+            entry = CachedReadings(window_start, columns, high_water)
+
+            with self._lock:
+                # Skip storing if the device was invalidated meanwhile
+                if self._device_locks.get(device_id) is device_lock:
+                    self.entries[device_id] = entry
+                    self.entries.move_to_end(device_id)
+                    self._evict(keep=device_id)
+        return entry
+
+    def _evict(self, keep):
+        total = sum(len(entry) for entry in self.entries.values())
+        while total > self.max_rows and len(self.entries) > 1:
+            device_id = next(iter(self.entries))
+            if device_id == keep:
+                break
+            total -= len(self.entries.pop(device_id))
+            self.stats['evictions'] += 1
+
+    def invalidate(self, device_id):
+        # Call when a device is deleted
+        with self._lock:
+            self.entries.pop(device_id, None)
+            self._device_locks.pop(device_id, None)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self._device_locks.clear()
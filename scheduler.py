@@ -0,0 +1,203 @@
+import asyncio
+import os
+import threading
+import time
+
+# Central admission control for Tuya API calls: a token bucket per access_id
+# (cloud project quota) and a circuit breaker per api_endpoint. Interactive
+# calls (device control) may use the whole bucket; background polling must
+# leave INTERACTIVE_RESERVE tokens untouched, so a busy poller never delays a
+# user's ON/OFF click.
+#
+# The state lives in the process: the collector and the dashboard each have
+# their own buckets and breakers. Within the collector the reserve protects
+# its own token renewals and retries; across processes nothing is shared, so
+# TUYA_RATE_LIMIT / TUYA_RATE_BURST of the collector must leave headroom
+# under the project's quota for the dashboard's (rare) ON/OFF commands.
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+RATE_LIMIT = float(os.getenv("TUYA_RATE_LIMIT", 10))  # requests per second per access_id
+RATE_BURST = float(os.getenv("TUYA_RATE_BURST", 20))
+INTERACTIVE_RESERVE = float(os.getenv("TUYA_INTERACTIVE_RESERVE", 2))
+THROTTLE_BACKOFF = float(os.getenv("TUYA_THROTTLE_BACKOFF", 10))  # seconds to pause a throttled project
+BREAKER_THRESHOLD = int(os.getenv("TUYA_BREAKER_THRESHOLD", 5))
+BREAKER_RESET_SECONDS = float(os.getenv("TUYA_BREAKER_RESET_SECONDS", 30))
+MAX_WAIT = {
+    PRIORITY_INTERACTIVE: float(os.getenv("TUYA_INTERACTIVE_MAX_WAIT", 5)),
+    PRIORITY_BACKGROUND: float(os.getenv("TUYA_BACKGROUND_MAX_WAIT", 30)),
+}
+
+
+class TokenBucket:
+    def __init__(self, rate=RATE_LIMIT, burst=RATE_BURST, reserve=INTERACTIVE_RESERVE):
+        self.rate = rate
+        self.burst = burst
+        self.reserve = min(reserve, burst - 1)
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, priority):
+        # Returns 0 when a token was taken, otherwise the seconds to wait before retrying
+        with self._lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self._refill(now)
+            floor = 0 if priority == PRIORITY_INTERACTIVE else self.reserve
+            if self.tokens - 1 >= floor:
+                self.tokens -= 1
+                return 0
+            return (floor + 1 - self.tokens) / self.rate
+
+    def release(self):
+        # Give back a token that was taken but not used
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + 1)
+
+    def pause(self, seconds):
+        with self._lock:
+            self.tokens = 0
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, threshold=BREAKER_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def _probe_pending(self, now):
+        # A probe that never reported back (cancelled, or failed outside the
+        # request path) is given up after reset_seconds so another caller may probe
+        return self.probing and now - self.probe_started < self.reset_seconds
+
+    def is_open(self):
+        # Non-mutating check used to fail fast before spending a rate-limit token
+        with self._lock:
+            if self.state == self.CLOSED:
+                return False
+            if self.state == self.OPEN:
+                return time.monotonic() - self.opened_at < self.reset_seconds
+            return self._probe_pending(time.monotonic())
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == self.OPEN and now - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self.probing = False
+            if self.state == self.HALF_OPEN and not self._probe_pending(now):
+                self.probing = True
+                self.probe_started = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                print(f"✅ Circuit closed for {self.name}")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                if self.state != self.OPEN:
+                    print(f"⚠️ Circuit opened for {self.name} after {self.failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+def is_throttled(status_code, result):
+    if status_code == 429:
+        return True
+    msg = str((result or {}).get("msg", "")).lower()
+    return "frequen" in msg or "too many" in msg
+
+
+class RequestScheduler:
+    def __init__(self):
+        self.buckets = {}
+        self.breakers = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, access_id):
+        with self._lock:
+            if access_id not in self.buckets:
+                self.buckets[access_id] = TokenBucket()
+            return self.buckets[access_id]
+
+    def breaker(self, api_endpoint):
+        with self._lock:
+            if api_endpoint not in self.breakers:
+                self.breakers[api_endpoint] = CircuitBreaker(api_endpoint)
+            return self.breakers[api_endpoint]
+
+    def _admit(self, access_id, api_endpoint, priority, waited):
+        # (admitted, rejection message, seconds to sleep before retrying)
+        breaker = self.breaker(api_endpoint)
+        if breaker.is_open():
+            return False, f"circuit open for {api_endpoint}", 0
+        bucket = self.bucket(access_id)
+        wait = bucket.try_acquire(priority)
+        if wait == 0:
+            if breaker.allow():
+                return True, None, 0
+            # Another caller took the half-open probe in the meantime
+            bucket.release()
+            return False, f"circuit open for {api_endpoint}", 0
+        if waited + wait > MAX_WAIT[priority]:
+            return False, f"rate limit for {access_id} exceeded", 0
+        return False, None, wait
+
+    def acquire(self, access_id, api_endpoint, priority=PRIORITY_INTERACTIVE):
+        waited = 0.0
+        while True:
+            admitted, error, wait = self._admit(access_id, api_endpoint, priority, waited)
+            if admitted or error:
+                return error
+            time.sleep(wait)
+            waited += wait
+
+    async def acquire_async(self, access_id, api_endpoint, priority=PRIORITY_BACKGROUND):
+        waited = 0.0
+        while True:
+            admitted, error, wait = self._admit(access_id, api_endpoint, priority, waited)
+            if admitted or error:
+                return error
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def record(self, access_id, api_endpoint, status_code=None, result=None, error=None):
+        breaker = self.breaker(api_endpoint)
+        if error is not None or status_code is None or status_code >= 500:
+            breaker.record_failure()
+            return
+        breaker.record_success()
+        if is_throttled(status_code, result):
+            print(f"⚠️ Tuya throttled {access_id}, pausing for {THROTTLE_BACKOFF:.0f}s")
+            self.bucket(access_id).pause(THROTTLE_BACKOFF)
+
+
+scheduler = RequestScheduler()
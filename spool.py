@@ -0,0 +1,205 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, UTC
+
+import psycopg2
+
+from db import insert_readings
+
+SPOOL_PATH = os.getenv("SPOOL_PATH", "reading_spool.db")
+SPOOL_BATCH_SIZE = int(os.getenv("SPOOL_BATCH_SIZE", 5000))
+SPOOL_DRAIN_SECONDS = float(os.getenv("SPOOL_DRAIN_SECONDS", 1))
+SPOOL_MAX_BACKOFF = float(os.getenv("SPOOL_MAX_BACKOFF_SECONDS", 60))
+SPOOL_SYNCHRONOUS = os.getenv("SPOOL_SYNCHRONOUS", "NORMAL").upper()  # FULL also survives power loss
+
+# Errors of the data rather than the connection: retrying never helps, so the
+# offending readings are moved to the dead_letters table
+REJECTED_ERRORS = (psycopg2.IntegrityError, psycopg2.DataError)
+
+
+class Spool:
+    # Durable store-and-forward queue between the collector and PostgreSQL.
+    # append() commits readings to a local SQLite database in WAL mode, so
+    # ingest latency is a local fsync and nothing is lost while the database
+    # is down or slow. A drainer thread replays the spool into energy_usage in
+    # batches, oldest first, and deletes a batch only after it was committed
+    # upstream. Replaying a batch twice (e.g. after a crash between the two
+    # steps) is harmless because insert_readings upserts on
+    # (device_id, timestamp). A batch PostgreSQL rejects for its data (e.g. no
+    # partition for a reading's month) is split until the offending readings
+    # are isolated; those move to the local dead_letters table with the error
+    # and the rest is drained, so one bad reading never stalls the spool.
+
+    def __init__(self, path=SPOOL_PATH, sink=insert_readings, batch_size=SPOOL_BATCH_SIZE,
+                 drain_interval=SPOOL_DRAIN_SECONDS, max_backoff=SPOOL_MAX_BACKOFF):
+        self.path = path
+        self.sink = sink
+        self.batch_size = batch_size
+        self.drain_interval = drain_interval
+        self.max_backoff = max_backoff
+        self.stats = {'appended': 0, 'drained': 0, 'drain_failures': 0, 'dead_lettered': 0}
+        self._lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(f'PRAGMA synchronous={SPOOL_SYNCHRONOUS}')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS readings (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                device_id INTEGER NOT NULL,
+                timestamp TEXT NOT NULL,
+                power REAL,
+                voltage REAL,
+                current REAL
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                seq INTEGER PRIMARY KEY,
+                device_id INTEGER NOT NULL,
+                timestamp TEXT NOT NULL,
+                power REAL,
+                voltage REAL,
+                current REAL,
+                error TEXT,
+                rejected_at TEXT NOT NULL
+            )
+        ''')
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="spool-drainer", daemon=True)
+        self._thread.start()
+        return self
+
+    def append(self, rows):
+        # Collector sink: (device_id, timestamp, power, voltage, current) tuples
+        rows = [
+            (row[0], row[1].isoformat(sep=' ') if isinstance(row[1], datetime) else row[1], *row[2:])
+            for row in rows
+        ]
+        if not rows:
+            return 0
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.conn.executemany('''
+                    INSERT INTO readings (device_id, timestamp, power, voltage, current)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', rows)
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        self.stats['appended'] += len(rows)
+        self._wakeup.set()
+        return len(rows)
+
+    def pending(self):
+        with self._lock:
+            return self.conn.execute('SELECT COUNT(*) FROM readings').fetchone()[0]
+
+    def dead_letters(self):
+        with self._lock:
+            return self.conn.execute('SELECT COUNT(*) FROM dead_letters').fetchone()[0]
+
+    def _sink_isolating(self, batch):
+        # Sinks `batch`, splitting it in halves while PostgreSQL rejects it;
+        # returns the [(row, error)] that were rejected on their own. Connection
+        # errors propagate and the whole batch is retried later (already written
+        # halves are upserted again, which is harmless).
+        chunks, rejected = [batch], []
+        while chunks:
+            chunk = chunks.pop()
+            try:
+                self.sink([row[1:] for row in chunk])
+            except REJECTED_ERRORS as e:
+                if len(chunk) == 1:
+                    rejected.append((chunk[0], str(e).strip()))
+                    continue
+                middle = len(chunk) // 2
+                chunks += [chunk[middle:], chunk[:middle]]
+        return rejected
+
+    def drain_once(self):
+        # Replays the oldest batch; returns the number of readings drained
+        with self._drain_lock:
+            with self._lock:
+                batch = self.conn.execute('''
+                    SELECT seq, device_id, timestamp, power, voltage, current
+                    FROM readings ORDER BY seq LIMIT ?
+                ''', (self.batch_size,)).fetchall()
+            if not batch:
+                return 0
+
+            rejected = self._sink_isolating(batch)
+
+            rejected_at = datetime.now(UTC).isoformat(sep=' ')
+            with self._lock:
+                self.conn.execute('BEGIN IMMEDIATE')
+                try:
+                    self.conn.executemany('''
+                        INSERT INTO dead_letters
+                        (seq, device_id, timestamp, power, voltage, current, error, rejected_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', [(*row, error, rejected_at) for row, error in rejected])
+                    self.conn.execute('DELETE FROM readings WHERE seq <= ?', (batch[-1][0],))
+                    self.conn.execute('COMMIT')
+                except Exception:
+                    self.conn.execute('ROLLBACK')
+                    raise
+            if rejected:
+                (_, device_id, timestamp, *_), error = rejected[0]
+                print(f"⚠️ {len(rejected)} readings rejected by PostgreSQL, moved to dead_letters in {self.path} "
+                      f"(first: device {device_id} at {timestamp}: {error.splitlines()[0]})")
+            self.stats['dead_lettered'] += len(rejected)
+            self.stats['drained'] += len(batch) - len(rejected)
+            return len(batch)
+
+    def drain(self, timeout=None):
+        # Drain until the spool is empty (or `timeout` passes); returns the count
+        deadline = None if timeout is None else time.monotonic() + timeout
+        drained = 0
+        while deadline is None or time.monotonic() < deadline:
+            count = self.drain_once()
+            drained += count
+            if count == 0:
+                break
+        return drained
+
+    def _run(self):
+        backoff = self.drain_interval
+        while not self._stop_event.is_set():
+            try:
+                count = self.drain_once()
+                backoff = self.drain_interval
+            except Exception as e:
+                print(f"Spool drain failed, {self.pending()} readings kept locally: {e}")
+                self.stats['drain_failures'] += 1
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            if count < self.batch_size:
+                self._wakeup.wait(self.drain_interval)
+                self._wakeup.clear()
+
+    def close(self, timeout=10):
+        # Stop the drainer and try a last drain; anything left stays on disk
+        # and is replayed on the next start.
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        try:
+            self.drain(timeout)
+        except Exception as e:
+            print(f"Final spool drain failed: {e}")
+        left = self.pending()
+        if left:
+            print(f"⚠️ {left} readings left in {self.path}, they will be sent on the next start")
+        self.conn.close()
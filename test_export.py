@@ -0,0 +1,40 @@
+import io
+from datetime import datetime, timedelta
+
+import pyarrow.parquet as pq
+import pytest
+
+import db
+from export import EXPORT_COLUMNS, export_readings
+
+START = datetime(2026, 10, 15)
+END = START + timedelta(days=1)
+
+
+@pytest.fixture
+def readings(database):
+    db.add_classroom('A101')
+    db.add_device('plug', 1, 'id', 'key', 'tuya-plug', 'https://api')
+    db.insert_readings([(1, START + timedelta(minutes=5 * i), 100.0 + i, 230.0, 0.5) for i in range(6)])
+
+
+@pytest.mark.parametrize('resample', [None, '15 minutes'])
+def test_csv_header_names_every_column(readings, resample):
+    # COPY ... WITH HEADER takes the header from the query's column names;
+    # unaliased AVG(...) columns would all come out as "avg"
+    out = io.BytesIO()
+    rows = export_readings(out, START, END, 'csv', resample=resample)
+    lines = out.getvalue().decode('utf8').splitlines()
+    assert lines[0] == ','.join(EXPORT_COLUMNS)
+    assert len(lines) == rows + 1
+    assert rows == (2 if resample else 6)
+
+
+def test_parquet_resample_averages_each_bucket(readings, tmp_path):
+    path = tmp_path / 'export.parquet'
+    assert export_readings(path, START, END, 'parquet', resample='15 minutes') == 2
+    table = pq.read_table(path)
+    assert tuple(table.column_names) == EXPORT_COLUMNS
+    assert table.column('timestamp').to_pylist() == [START, START + timedelta(minutes=15)]
+    assert table.column('power').to_pylist() == [101.0, 104.0]
+    assert set(table.column('device').to_pylist()) == {'plug'}
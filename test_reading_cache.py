@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta, UTC
+
+import pytest
+
+from reading_cache import ReadingCache
+
+
+def now():
+    return datetime.now(UTC).replace(tzinfo=None)
+
+
+class Readings:
+    # Stands in for db.fetch_since over an in-memory energy_usage; every call
+    # is recorded as (device_id, ingested_after, rows returned)
+    def __init__(self):
+        self.rows = {}
+        self.calls = []
+
+    def write(self, device_id, timestamp, power, ingested_at=None):
+        rows = [row for row in self.rows.get(device_id, []) if row[0] != timestamp]
+        rows.append((timestamp, power, 230.0, 0.5, ingested_at or now()))
+        self.rows[device_id] = sorted(rows)
+
+    def __call__(self, device_id, ingested_after=None, start=None):
+        rows = [row for row in self.rows.get(device_id, [])
+                if (ingested_after is None or row[4] > ingested_after) and (start is None or row[0] >= start)]
+        self.calls.append((device_id, ingested_after, len(rows)))
+        return rows
+
+
+@pytest.fixture
+def readings():
+    return Readings()
+
+
+def test_refresh_fetches_from_the_high_water_mark_with_overlap(readings):
+    cache = ReadingCache(days=1, fetch=readings, overlap=30)
+    start = now() - timedelta(hours=1)
+    for i in range(10):
+        readings.write(1, start + timedelta(minutes=i), 100.0 + i, ingested_at=start + timedelta(minutes=i))
+    assert len(cache.get(1)) == 10
+    high_water = cache.get(1).high_water
+    assert high_water == start + timedelta(minutes=9)
+
+    # A new reading, a late one and a rewritten one arrive after the load
+    readings.write(1, start + timedelta(minutes=10), 110.0)
+    readings.write(1, start + timedelta(seconds=90), 101.5)
+    readings.write(1, start + timedelta(minutes=3), 999.0)
+    entry = cache.get(1)
+
+    assert readings.calls[-1][1] == high_water - timedelta(seconds=30)
+    assert readings.calls[-1][2] == 4  # the overlap fetches the last loaded reading again
+    assert len(entry) == 12
+    assert list(entry.columns['power'][:4]) == [100.0, 101.0, 101.5, 102.0]
+    assert entry.columns['power'][4] == 999.0
+    assert entry.latest()[1] == 110.0
+
+
+def test_readings_outside_the_window_are_dropped(readings):
+    cache = ReadingCache(days=1, fetch=readings)
+    readings.write(1, now() - timedelta(days=2), 1.0)
+    readings.write(1, now() - timedelta(hours=2), 2.0)
+    entry = cache.get(1)
+    assert list(entry.columns['power']) == [2.0]
+    assert not entry.covers(now() - timedelta(days=2))
+    assert entry.covers(now() - timedelta(hours=12))
+
+
+def test_least_recently_used_device_is_evicted(readings):
+    cache = ReadingCache(max_rows=5, days=1, fetch=readings)
+    for device_id in (1, 2, 3):
+        for i in range(2):
+            readings.write(device_id, now() - timedelta(minutes=i + 1), float(device_id))
+    cache.get(1)
+    cache.get(2)
+    cache.get(1)  # device 2 is now the least recently used
+    cache.get(3)
+
+    assert list(cache.entries) == [1, 3]
+    assert cache.rows() == 4
+    assert cache.stats['evictions'] == 1
+
+    # An evicted device is loaded again from scratch
+    cache.get(2)
+    assert readings.calls[-1] == (2, None, 2)
@@ -0,0 +1,69 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+
+import db
+
+END = datetime(2026, 10, 16, 14, 37, 12)
+
+
+class RecordingCursor:
+    def __init__(self, queries):
+        self.queries = queries
+
+    def execute(self, sql, params=None):
+        self.queries.append((sql, params))
+
+    def fetchall(self):
+        return []
+
+
+@pytest.fixture
+def queries(monkeypatch):
+    queries = []
+
+    @contextmanager
+    def get_connection(statement_timeout=None):
+        class Connection:
+            def cursor(self):
+                return RecordingCursor(queries)
+        yield Connection()
+
+    monkeypatch.setattr(db, 'get_connection', get_connection)
+    return queries
+
+
+def test_pick_rollup_uses_the_coarsest_table_with_enough_buckets():
+    assert db.pick_rollup(END - timedelta(days=30), END)[0] == 'energy_rollup_1d'
+    assert db.pick_rollup(END - timedelta(days=7), END)[0] == 'energy_rollup_1h'
+    assert db.pick_rollup(END - timedelta(hours=1), END)[0] == 'energy_rollup_1m'
+
+
+def test_fetch_rollup_queries_the_chosen_rollup(queries):
+    db.fetch_rollup(1, END - timedelta(days=30), END)
+    sql, params = queries[-1]
+    assert 'FROM energy_rollup_1d' in sql
+    assert 'energy_usage' not in sql
+    assert params == (1, END - timedelta(days=30), END)
+
+
+def test_rollup_cover_tiles_the_range_coarsest_first():
+    start = END - timedelta(days=30)
+    cover = db.rollup_cover(start, END)
+    assert [table for table, _, _ in cover] == ['energy_rollup_1d', 'energy_rollup_1h', 'energy_rollup_1h',
+                                                'energy_rollup_1m', 'energy_rollup_1m']
+    assert cover[0][1:] == (datetime(2026, 9, 17), datetime(2026, 10, 16))
+    # Whole buckets, no gaps and no overlap
+    spans = sorted((first, last) for _, first, last in cover)
+    assert spans[0][0] == datetime(2026, 9, 16, 14, 37) and spans[-1][1] == END
+    assert all(previous[1] == following[0] for previous, following in zip(spans, spans[1:]))
+
+
+def test_rollup_energy_summary_reads_rollups_only(queries):
+    summary = db.get_rollup_energy_summary(END - timedelta(days=30), END, 3.8, device_id=1)
+    sql, params = queries[-1]
+    assert 'FROM energy_rollup_1d' in sql and 'FROM energy_rollup_1m' in sql
+    assert 'energy_usage' not in sql
+    assert params[-4:] == (1, 1, None, None)
+    assert summary == {'total_kwh': 0.0, 'total_cost': 0.0, 'daily': []}
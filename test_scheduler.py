@@ -0,0 +1,94 @@
+import pytest
+
+import scheduler
+from scheduler import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, CircuitBreaker, RequestScheduler, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Replaces time.monotonic in the scheduler with a clock the test advances
+    class Clock:
+        now = 1000.0
+
+        def monotonic(self):
+            return self.now
+
+        def advance(self, seconds):
+            self.now += seconds
+
+    clock = Clock()
+    monkeypatch.setattr(scheduler.time, 'monotonic', clock.monotonic)
+    return clock
+
+
+def test_background_calls_leave_the_interactive_reserve(clock):
+    bucket = TokenBucket(rate=1, burst=5, reserve=2)
+    assert [bucket.try_acquire(PRIORITY_BACKGROUND) for _ in range(3)] == [0, 0, 0]
+    assert bucket.try_acquire(PRIORITY_BACKGROUND) > 0
+
+    # The reserved tokens still serve interactive calls right away
+    assert [bucket.try_acquire(PRIORITY_INTERACTIVE) for _ in range(2)] == [0, 0]
+    assert bucket.try_acquire(PRIORITY_INTERACTIVE) == pytest.approx(1)
+
+    # Background has to wait until the bucket refills above the reserve again
+    clock.advance(2)
+    assert bucket.try_acquire(PRIORITY_BACKGROUND) > 0
+    clock.advance(1)
+    assert bucket.try_acquire(PRIORITY_BACKGROUND) == 0
+
+
+def test_breaker_opens_probes_and_closes(clock):
+    breaker = CircuitBreaker('https://api', threshold=2, reset_seconds=30)
+    breaker.record_failure()
+    assert not breaker.is_open()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.is_open() and not breaker.allow()
+
+    # After the reset period exactly one caller gets through as the probe
+    clock.advance(30)
+    assert not breaker.is_open()
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.is_open() and not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_failed_probe_reopens_the_breaker(clock):
+    breaker = CircuitBreaker('https://api', threshold=1, reset_seconds=30)
+    breaker.record_failure()
+    clock.advance(30)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_probe_that_never_reports_back_is_given_up(clock):
+    breaker = CircuitBreaker('https://api', threshold=1, reset_seconds=30)
+    breaker.record_failure()
+    clock.advance(30)
+    assert breaker.allow()
+
+    # The probe was cancelled before it could record a result
+    clock.advance(29)
+    assert not breaker.allow()
+    clock.advance(1)
+    assert breaker.allow()
+
+
+def test_token_is_returned_when_another_caller_took_the_probe(clock, monkeypatch):
+    requests = RequestScheduler()
+    breaker = requests.breaker('https://api')
+    breaker.state, breaker.probing, breaker.probe_started = CircuitBreaker.HALF_OPEN, True, clock.now
+    # The probe is taken between this caller's is_open() check and its allow()
+    monkeypatch.setattr(breaker, 'is_open', lambda: False)
+    bucket = requests.bucket('id')
+    tokens = bucket.tokens
+
+    assert requests._admit('id', 'https://api', PRIORITY_INTERACTIVE, 0) == \
+        (False, "circuit open for https://api", 0)
+    assert bucket.tokens == tokens
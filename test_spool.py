@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+
+import psycopg2
+import pytest
+
+from spool import Spool
+
+START = datetime(2026, 10, 16, 12, 0)
+
+
+def readings(count, device_id=1):
+    return [(device_id, START + timedelta(seconds=30 * i), 100.0 + i, 230.0, 0.5) for i in range(count)]
+
+
+class Sink:
+    # Stands in for insert_readings; `down` fails every call like a lost
+    # connection, and readings of `bad_devices` are rejected like PostgreSQL does
+    def __init__(self):
+        self.written = []
+        self.calls = 0
+        self.down = False
+        self.bad_devices = set()
+
+    def __call__(self, rows):
+        self.calls += 1
+        if self.down:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        if any(row[0] in self.bad_devices for row in rows):
+            raise psycopg2.IntegrityError("violates foreign key constraint")
+        self.written += rows
+        return len(rows)
+
+
+@pytest.fixture
+def sink():
+    return Sink()
+
+
+@pytest.fixture
+def spool(tmp_path, sink):
+    spool = Spool(path=str(tmp_path / 'spool.db'), sink=sink, batch_size=4)
+    yield spool
+    spool.conn.close()
+
+
+def test_drain_replays_readings_in_order(spool, sink):
+    assert spool.append(readings(10)) == 10
+    assert spool.pending() == 10
+    assert spool.drain() == 10
+    assert spool.pending() == 0
+    assert [row[1] for row in sink.written] == [str(row[1]) for row in readings(10)]
+    assert sink.calls == 3  # batches of 4, 4 and 2
+
+
+def test_readings_survive_a_restart(tmp_path, sink):
+    path = str(tmp_path / 'spool.db')
+    first = Spool(path=path, sink=sink)
+    first.append(readings(3))
+    first.conn.close()
+
+    second = Spool(path=path, sink=sink)
+    assert second.pending() == 3
+    assert second.drain() == 3
+    second.conn.close()
+
+
+def test_connection_errors_keep_the_batch_for_a_retry(spool, sink):
+    spool.append(readings(3))
+    sink.down = True
+    with pytest.raises(psycopg2.OperationalError):
+        spool.drain_once()
+    assert spool.pending() == 3
+    assert sink.written == []
+
+    sink.down = False
+    assert spool.drain() == 3
+    assert spool.pending() == 0
+    assert spool.dead_letters() == 0
+
+
+def test_rejected_readings_move_to_dead_letters(spool, sink):
+    sink.bad_devices = {2}
+    spool.append(readings(3) + readings(1, device_id=2))
+    assert spool.drain() == 4
+    assert spool.pending() == 0
+    assert spool.dead_letters() == 1
+    assert spool.stats['dead_lettered'] == 1 and spool.stats['drained'] == 3
+    assert sorted(row[0] for row in sink.written) == [1, 1, 1]
+
+    device_id, error = spool.conn.execute('SELECT device_id, error FROM dead_letters').fetchone()
+    assert device_id == 2 and 'foreign key' in error
@@ -0,0 +1,80 @@
+import time
+
+import pytest
+
+import tuya_play
+from tuya_play import TO_B_TOKEN_API, TOKEN_INVALID_CODE, TuyaTokenManager
+
+
+def token_response(access_token, expire=7200, refresh_token='refresh'):
+    return {'success': True, 't': int(time.time() * 1000),
+            'result': {'access_token': access_token, 'expire_time': expire, 'refresh_token': refresh_token}}
+
+
+@pytest.fixture
+def cloud(monkeypatch):
+    # Stands in for tuya_play.request; `responses` maps a path to the queue of
+    # results it returns, and every call is recorded
+    class Cloud:
+        def __init__(self):
+            self.calls = []
+            self.responses = {}
+            self.issued = 0
+
+        def request(self, method, path, params, body, access_id, access_key, api_endpoint, token_info=None,
+                    priority=None):
+            self.calls.append((method, path, token_info.access_token if token_info else None))
+            if path.startswith(TO_B_TOKEN_API):
+                self.issued += 1
+                return token_response(f"token-{self.issued}")
+            return self.responses[path].pop(0)
+
+    cloud = Cloud()
+    monkeypatch.setattr(tuya_play, 'request', cloud.request)
+    monkeypatch.setattr(tuya_play, 'token_manager', TuyaTokenManager())
+    return cloud
+
+
+def test_token_is_cached_until_close_to_expiry(cloud):
+    manager = TuyaTokenManager(refresh_margin=120)
+    first = manager.get_token('id', 'key', 'https://api')
+    assert manager.get_token('id', 'key', 'https://api') is first
+    assert cloud.issued == 1
+
+    # Inside the refresh margin the refresh token is used instead of a new grant
+    first.expire_time = time.time() * 1000 + 60 * 1000
+    renewed = manager.get_token('id', 'key', 'https://api')
+    assert renewed.access_token == 'token-2'
+    assert cloud.calls[-1][1] == f"{TO_B_TOKEN_API}/refresh"
+
+
+def test_tokens_are_cached_per_project_and_invalidated(cloud):
+    manager = TuyaTokenManager()
+    a = manager.get_token('a', 'key', 'https://api')
+    b = manager.get_token('b', 'key', 'https://api')
+    assert a.access_token != b.access_token
+
+    manager.invalidate('a', 'https://api')
+    assert manager.get_token('a', 'key', 'https://api').access_token == 'token-3'
+    assert manager.get_token('b', 'key', 'https://api') is b
+
+
+def test_switch_command_renews_a_revoked_token_once(cloud):
+    path = '/v1.0/devices/dev/commands'
+    cloud.responses[path] = [{'success': False, 'code': TOKEN_INVALID_CODE, 'msg': 'token invalid'},
+                             {'success': True, 'result': True}]
+    stale = tuya_play.token_manager.get_token('id', 'key', 'https://api')
+
+    assert tuya_play.set_device_switch(True, 'dev', 'id', 'key', 'https://api', stale) == (True, 'switch')
+    commands = [call for call in cloud.calls if call[1] == path]
+    assert [token for _, _, token in commands] == ['token-1', 'token-2']
+    assert tuya_play.token_manager.get_token('id', 'key', 'https://api').access_token == 'token-2'
+
+
+def test_switch_command_gives_up_after_one_renewal(cloud):
+    path = '/v1.0/devices/dev/commands'
+    cloud.responses[path] = [{'success': False, 'code': TOKEN_INVALID_CODE}] * 2
+    stale = tuya_play.token_manager.get_token('id', 'key', 'https://api')
+
+    assert tuya_play.set_device_switch(False, 'dev', 'id', 'key', 'https://api', stale) == (False, 'switch')
+    assert len([call for call in cloud.calls if call[1] == path]) == 2
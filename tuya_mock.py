@@ -0,0 +1,301 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from scheduler import TokenBucket, PRIORITY_INTERACTIVE
+from tuya_play import MAX_BATCH_SIZE, TOKEN_INVALID_CODE, TuyaTokenInfo, calculate_sign
+
+# Local simulator of the Tuya OpenAPI endpoints used by this project: token
+# grant/refresh, device status (single and batch), shadow properties,
+# specifications, thing model and commands. Request signatures are checked
+# with calculate_sign, and latency, server errors and per-project throttling
+# are configurable. Start it with `python tuya_mock.py --devices 500` and
+# point a device's API Endpoint at the printed URL.
+
+MOCK_ACCESS_KEY = "mock-access-key"
+SIGN_INVALID_CODE = 1004
+
+
+def mock_device_id(n):
+    return f"mockdev{n:05d}"
+
+
+def route_device_id(path):
+    # Device ID of a per-device route: /v1.0/devices/{id}/... (status,
+    # specifications, commands) or /v2.0/cloud/thing/{id}/... (shadow, model)
+    parts = path.strip("/").split("/")
+    if len(parts) > 3 and parts[1] == "devices":
+        return parts[2]
+    if len(parts) > 4 and parts[1:3] == ["cloud", "thing"]:
+        return parts[3]
+    return None
+
+
+SPECS = {
+    "cur_power": {"unit": "W", "scale": 1},
+    "cur_voltage": {"unit": "V", "scale": 1},
+    "cur_current": {"unit": "mA", "scale": 0},
+}
+
+
+class MockCloud:
+    def __init__(self, device_count=10, shadow_every=0, access_key=MOCK_ACCESS_KEY, latency_ms=0,
+                 jitter_ms=0, error_rate=0.0, throttle_rps=0, verify_sign=True, token_ttl=7200):
+        # Every `shadow_every`-th device only reports metrics through shadow
+        # properties, like plugs whose /status payload is switch-only.
+        self.device_ids = [mock_device_id(n) for n in range(device_count)]
+        self.switches = {device_id: True for device_id in self.device_ids}
+        self.shadow_only = {
+            device_id for n, device_id in enumerate(self.device_ids)
+            if shadow_every and n % shadow_every == 0
+        }
+        self.access_key = access_key
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rps = throttle_rps
+        self.verify_sign = verify_sign
+        self.token_ttl = token_ttl
+        self.tokens = {}
+        self.refresh_tokens = {}
+        self.buckets = {}
+        self.request_counts = {}
+        self._lock = threading.Lock()
+
+    def count(self, route):
+        with self._lock:
+            self.request_counts[route] = self.request_counts.get(route, 0) + 1
+
+    def reset_counts(self):
+        with self._lock:
+            self.request_counts = {}
+
+    def properties(self, device_id):
+        switch = self.switches[device_id]
+        power = random.randint(100, 20000) if switch else 0
+        return [
+            {"code": "switch_1", "value": switch},
+            {"code": "cur_power", "value": power},
+            {"code": "cur_voltage", "value": random.randint(2200, 2400)},
+            {"code": "cur_current", "value": power // 23 if switch else 0},
+        ]
+
+    def status(self, device_id):
+        items = self.properties(device_id)
+        return items[:1] if device_id in self.shadow_only else items
+
+    def issue_token(self, client_id):
+        access_token = f"mock-token-{random.getrandbits(64):016x}"
+        refresh_token = f"mock-refresh-{random.getrandbits(64):016x}"
+        with self._lock:
+            self.tokens[access_token] = (client_id, time.time() + self.token_ttl)
+            self.refresh_tokens[refresh_token] = client_id
+        return {"success": True, "t": int(time.time() * 1000), "result": {
+            "access_token": access_token,
+            "refresh_token": refresh_token,
+            "expire_time": self.token_ttl,
+            "uid": "mock-uid",
+        }}
+
+    def token_valid(self, client_id, access_token):
+        owner, expires = self.tokens.get(access_token, (None, 0))
+        return owner == client_id and expires > time.time()
+
+    def sign_valid(self, method, path, query, body, headers, with_token):
+        try:
+            t = int(headers.get("t", ""))
+        except ValueError:
+            return False
+        params = {key: values[0] for key, values in query.items()} or None
+        token_info = None
+        if with_token:
+            token_info = TuyaTokenInfo({"result": {"access_token": headers.get("access_token", "")}})
+        expected, _ = calculate_sign(method, path, params, body, headers.get("client_id", ""),
+                                     self.access_key, token_info, t)
+        return expected == headers.get("sign")
+
+    def throttled(self, client_id):
+        if not self.throttle_rps:
+            return False
+        with self._lock:
+            bucket = self.buckets.get(client_id)
+            if bucket is None:
+                bucket = self.buckets[client_id] = TokenBucket(self.throttle_rps, self.throttle_rps, 0)
+        return bucket.try_acquire(PRIORITY_INTERACTIVE) != 0
+
+    def handle(self, method, path, query, body, headers):
+        # Returns (http_status, payload); payload is a dict or plain text
+        if self.latency_ms or self.jitter_ms:
+            time.sleep(max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) / 1000)
+
+        if self.error_rate and random.random() < self.error_rate:
+            self.count("error")
+            return 500, "Internal Server Error"
+
+        client_id = headers.get("client_id", "")
+        if self.throttled(client_id):
+            self.count("throttled")
+            return 429, {"success": False, "msg": "request frequency is too high"}
+
+        is_token_path = path == "/v1.0/token" or path.startswith("/v1.0/token/")
+        if self.verify_sign and not self.sign_valid(method, path, query, body, headers, not is_token_path):
+            self.count("sign_invalid")
+            return 200, {"success": False, "code": SIGN_INVALID_CODE, "msg": "sign invalid"}
+
+        if is_token_path:
+            self.count("token")
+            if path.startswith("/v1.0/token/"):
+                with self._lock:
+                    owner = self.refresh_tokens.pop(path[len("/v1.0/token/"):], None)
+                if owner != client_id:
+                    return 200, {"success": False, "code": TOKEN_INVALID_CODE, "msg": "token invalid"}
+            return 200, self.issue_token(client_id)
+
+        if self.verify_sign and not self.token_valid(client_id, headers.get("access_token", "")):
+            self.count("token_invalid")
+            return 200, {"success": False, "code": TOKEN_INVALID_CODE, "msg": "token invalid"}
+
+        return 200, self.handle_device(method, path, query, body)
+
+    def handle_device(self, method, path, query, body):
+        if path == "/v1.0/iot-03/devices/status":
+            self.count("batch_status")
+            ids = [i for i in query.get("device_ids", [""])[0].split(",") if i]
+            if len(ids) > MAX_BATCH_SIZE:
+                return {"success": False, "code": 1100, "msg": "param is illegal"}
+            return {"success": True, "result": [
+                {"id": device_id, "status": self.status(device_id)}
+                for device_id in ids if device_id in self.switches
+            ]}
+
+        device_id = route_device_id(path)
+        if device_id not in self.switches:
+            self.count("unknown")
+            return {"success": False, "code": 1106, "msg": "permission deny"}
+
+        if path.endswith("/status"):
+            self.count("status")
+            return {"success": True, "result": self.status(device_id)}
+
+        if path.endswith("/shadow/properties"):
+            self.count("shadow")
+            return {"success": True, "result": {"properties": self.properties(device_id)}}
+
+        if path.endswith("/specifications"):
+            self.count("specifications")
+            return {"success": True, "result": {
+                "category": "cz",
+                "functions": [{"code": "switch_1", "type": "Boolean", "values": "{}"}],
+                "status": [{"code": code, "type": "Integer", "values": json.dumps(spec)}
+                           for code, spec in SPECS.items()],
+            }}
+
+        if path.endswith("/model"):
+            self.count("model")
+            model = {"services": [{"properties": [
+                {"code": code, "typeSpec": dict(spec, type="value")} for code, spec in SPECS.items()
+            ] + [{"code": "switch_1", "typeSpec": {"type": "bool"}}]}]}
+            return {"success": True, "result": {"model": json.dumps(model)}}
+
+        if path.endswith("/commands") and method == "POST":
+            self.count("commands")
+            for command in (body or {}).get("commands", []):
+                if command.get("code") in ("switch", "switch_1"):
+                    self.switches[device_id] = bool(command.get("value"))
+            return {"success": True, "result": True}
+
+        self.count("unknown")
+        return {"success": False, "code": 1108, "msg": "uri path invalid"}
+
+
+def make_handler(cloud):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _respond(self, method):
+            url = urlparse(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"null") if length else None
+            status, payload = cloud.handle(method, url.path, parse_qs(url.query), body, self.headers)
+            if isinstance(payload, dict):
+                data, content_type = json.dumps(payload).encode("utf8"), "application/json"
+            else:
+                data, content_type = payload.encode("utf8"), "text/plain"
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._respond("GET")
+
+        def do_POST(self):
+            self._respond("POST")
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class MockTuyaServer:
+    def __init__(self, device_count=10, host="127.0.0.1", port=0, shadow_every=0, **options):
+        self.cloud = MockCloud(device_count, shadow_every, **options)
+        self.httpd = ThreadingHTTPServer((host, port), make_handler(self.cloud))
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local simulator of the Tuya OpenAPI")
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--shadow-every", type=int, default=0,
+                        help="make every Nth device report metrics only via shadow properties")
+    parser.add_argument("--access-key", default=MOCK_ACCESS_KEY,
+                        help="secret used to verify request signatures")
+    parser.add_argument("--latency-ms", type=float, default=0, help="mean response latency")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="standard deviation of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of requests answered with HTTP 500")
+    parser.add_argument("--throttle-rps", type=float, default=0,
+                        help="requests per second per Access ID before answering HTTP 429 (0 = unlimited)")
+    parser.add_argument("--no-verify-sign", action="store_true", help="accept requests with any signature")
+    args = parser.parse_args()
+
+    server = MockTuyaServer(args.devices, args.host, args.port, args.shadow_every,
+                            access_key=args.access_key, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                            error_rate=args.error_rate, throttle_rps=args.throttle_rps,
+                            verify_sign=not args.no_verify_sign)
+    print(f"🧪 Mock Tuya cloud on {server.url} with {args.devices} devices "
+          f"({mock_device_id(0)} .. {mock_device_id(args.devices - 1)}), access key '{args.access_key}'")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
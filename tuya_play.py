@@ -1,10 +1,28 @@
+import asyncio
 import hashlib
 import hmac
 import json
+import os
+import threading
 import time
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from scheduler import scheduler, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
 
 TO_B_TOKEN_API = "/v1.0/token"
+TOKEN_REFRESH_MARGIN = 120  # seconds before expiry at which a cached token is renewed
+TOKEN_INVALID_CODE = 1010
+BATCH_STATUS_API = "/v1.0/iot-03/devices/status"
+MAX_BATCH_SIZE = 20
+
+HTTP_POOL_SIZE = int(os.getenv("TUYA_HTTP_POOL_SIZE", 20))
+HTTP_RETRIES = int(os.getenv("TUYA_HTTP_RETRIES", 2))
+HTTP_BACKOFF = float(os.getenv("TUYA_HTTP_BACKOFF", 0.5))
+CONNECT_TIMEOUT = float(os.getenv("TUYA_CONNECT_TIMEOUT", 3.05))
+READ_TIMEOUT = float(os.getenv("TUYA_READ_TIMEOUT", 10))
 
 class TuyaTokenInfo:
     def __init__(self, token_response=None):
@@ -18,8 +36,73 @@ class TuyaTokenInfo:
         self.refresh_token = result.get("refresh_token", "")
         self.uid = result.get("uid", "")
 
+    def is_valid(self, margin=0):
+        return bool(self.access_token) and self.expire_time - margin * 1000 > time.time() * 1000
+
+
+class TuyaTokenManager:
+    # Tokens are cached per (api_endpoint, access_id) and renewed through the
+    # refresh-token endpoint shortly before expiry, one refresh per key at a time.
+
+    def __init__(self, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self.refresh_margin = refresh_margin
+        self._tokens = {}
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def _lock_for(self, key):
+        with self._guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _fetch(self, path, params, access_id, access_key, api_endpoint, priority):
+        result = request("GET", path, params, None, access_id, access_key, api_endpoint, priority=priority)
+        if not result.get("success"):
+            print(f"Token request failed for {access_id}: {result.get('msg')}")
+            return None
+        return TuyaTokenInfo(result)
+
+    def get_token(self, access_id, access_key, api_endpoint, priority=PRIORITY_INTERACTIVE):
+        key = (api_endpoint, access_id)
+        token_info = self._tokens.get(key)
+        if token_info is not None and token_info.is_valid(self.refresh_margin):
+            return token_info
+
+        with self._lock_for(key):
+            token_info = self._tokens.get(key)
+            if token_info is not None and token_info.is_valid(self.refresh_margin):
+                return token_info
+
+            new_info = None
+            if token_info is not None and token_info.refresh_token:
+                new_info = self._fetch(f"{TO_B_TOKEN_API}/{token_info.refresh_token}", None,
+                                       access_id, access_key, api_endpoint, priority)
+            if new_info is None:
+                new_info = self._fetch(TO_B_TOKEN_API, {"grant_type": 1},
+                                       access_id, access_key, api_endpoint, priority)
+
+            if new_info is None:
+                # Keep serving the old token while it has not actually expired
+                if token_info is not None and token_info.is_valid():
+                    return token_info
+                return None
+
+            self._tokens[key] = new_info
+            return new_info
+
+    def invalidate(self, access_id, api_endpoint):
+        with self._lock_for((api_endpoint, access_id)):
+            self._tokens.pop((api_endpoint, access_id), None)
+
+
+token_manager = TuyaTokenManager()
 
-def calculate_sign(method, path, params, body, access_id, access_key, token_info=None):
+
+def get_token(access_id, access_key, api_endpoint, priority=PRIORITY_INTERACTIVE):
+    # The collector passes PRIORITY_BACKGROUND so its token renewals queue behind device control
+    return token_manager.get_token(access_id, access_key, api_endpoint, priority)
+
+
+def calculate_sign(method, path, params, body, access_id, access_key, token_info=None, t=None):
     str_to_sign = method
     str_to_sign += "\n"
 
@@ -42,7 +125,8 @@ def calculate_sign(method, path, params, body, access_id, access_key, token_info
             query_builder += f"{key}={params[key]}&"
         str_to_sign += query_builder[:-1]
 
-    t = int(time.time() * 1000)
+    if t is None:
+        t = int(time.time() * 1000)
 
     message = access_id
     if token_info is not None:
@@ -61,7 +145,7 @@ def calculate_sign(method, path, params, body, access_id, access_key, token_info
     return sign, t
 
 
-def request(method, path, params, body, access_id, access_key, api_endpoint, token_info=None):
+def build_headers(method, path, params, body, access_id, access_key, token_info=None):
     access_token = ""
     if token_info:
         access_token = token_info.access_token
@@ -79,130 +163,474 @@ def request(method, path, params, body, access_id, access_key, api_endpoint, tok
     headers["dev_lang"] = "python"
     headers["dev_version"] = "0.1.2"
     headers["dev_channel"] = "cloud_"
+    return headers
+
+
+class SessionPool:
+    # One keep-alive requests.Session per api_endpoint, shared by all threads.
+    # Only idempotent GETs are retried; commands are never replayed.
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, retries=HTTP_RETRIES, backoff=HTTP_BACKOFF):
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _create(self):
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size,
+                              max_retries=retry, pool_block=True)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def get(self, api_endpoint):
+        session = self._sessions.get(api_endpoint)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(api_endpoint)
+                if session is None:
+                    session = self._sessions[api_endpoint] = self._create()
+        return session
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
+
+
+session_pool = SessionPool()
 
+
+def parse_response(status_code, text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return {"success": False, "msg": f"HTTP {status_code}: invalid JSON response"}
+
+
+def request(method, path, params, body, access_id, access_key, api_endpoint, token_info=None,
+            priority=PRIORITY_INTERACTIVE):
+    # Admission goes through the shared scheduler: rate-limited per access_id,
+    # failing fast while the endpoint's circuit breaker is open.
+    error = scheduler.acquire(access_id, api_endpoint, priority)
+    if error:
+        return {"success": False, "msg": error}
+
+    headers = build_headers(method, path, params, body, access_id, access_key, token_info)
     url = f"{api_endpoint}{path}"
     
     try:
-        if method == "GET":
-            response = requests.get(url=url, params=params, json=body, headers=headers, timeout=10)
-        else:
-            response = requests.post(url=url, params=params, json=body, headers=headers, timeout=10)
-
-        result = response.json()
-        return result
+        session = session_pool.get(api_endpoint)
+        response = session.request(method, url=url, params=params, json=body, headers=headers,
+                                   timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
     except Exception as e:
+        scheduler.record(access_id, api_endpoint, error=e)
         print(f"Request error: {e}")
         return {"success": False, "msg": str(e)}
 
+    result = parse_response(response.status_code, response.text)
+    scheduler.record(access_id, api_endpoint, response.status_code, result)
+    return result
 
-def get_power_voltage_current(device_id, access_id, access_key, api_endpoint, token_info):
-    try:
-        path = f"/v1.0/devices/{device_id}/status"
-        result = request("GET", path, None, None, access_id, access_key, api_endpoint, token_info)
-        
-        if result.get("success"):
-            status = result.get("result", [])
-            
-            voltage = None
-            current = None
-            power = None
-            
-            for item in status:
-                code = item.get("code")
-                value = item.get("value")
-                
-                if value is None or not isinstance(value, (int, float)):
-                    continue
-
-                if code in ["cur_voltage", "voltage", "v"]:
-                    voltage = value / 10
-
-                elif code in ["cur_current", "current", "i"]:
-                    current = value / 1000
-                
-                elif code in ["cur_power", "power", "p"]:
-                    power = value / 10
-
-            if power is not None or voltage is not None or current is not None:
-                return power, voltage, current
-        
-        path = f"/v2.0/cloud/thing/{device_id}/shadow/properties"
-        result = request("GET", path, None, None, access_id, access_key, api_endpoint, token_info)
 
-        if not result.get("success"):
-            return None, None, None
+async def async_request(session, method, path, params, body, access_id, access_key, api_endpoint,
+                        token_info=None, priority=PRIORITY_BACKGROUND):
+    # Same contract as request(), issued through a shared aiohttp.ClientSession.
+    # Defaults to background priority since only the collector uses it. Like
+    # SessionPool, GETs are retried with backoff on connection errors, timeouts
+    # and 5xx responses (HTTP_RETRIES times); commands are never replayed.
+    error = await scheduler.acquire_async(access_id, api_endpoint, priority)
+    if error:
+        return {"success": False, "msg": error}
 
-        properties = result.get("result", {}).get("properties", [])
+    headers = build_headers(method, path, params, body, access_id, access_key, token_info)
+    url = f"{api_endpoint}{path}"
+    retries = HTTP_RETRIES if method == "GET" else 0
+
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(HTTP_BACKOFF * 2 ** (attempt - 1))
+        try:
+            async with session.request(method, url, params=params, json=body, headers=headers) as response:
+                status_code, text = response.status, await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt < retries:
+                continue
+            scheduler.record(access_id, api_endpoint, error=e)
+            print(f"Request error: {e!r}")
+            return {"success": False, "msg": str(e) or repr(e)}
+        except Exception as e:
+            scheduler.record(access_id, api_endpoint, error=e)
+            print(f"Request error: {e!r}")
+            return {"success": False, "msg": str(e) or repr(e)}
+        if status_code not in (500, 502, 503, 504) or attempt == retries:
+            break
 
-        voltage = None
-        current = None
-        power = None
+    result = parse_response(status_code, text)
+    scheduler.record(access_id, api_endpoint, status_code, result)
+    return result
 
-        for prop in properties:
-            code = prop.get("code")
-            value = prop.get("value")
-            
-            if value is None or not isinstance(value, (int, float)):
-                continue
-            
-            if code in ["output_voltage", "voltage", "cur_voltage", "v"]:
-                voltage = value / 10
 
-            elif code in ["output_current", "current", "cur_current", "i"]:
-                current = value / 1000
+STATUS_METRIC_CODES = {
+    "voltage": (["cur_voltage", "voltage", "v"], 10),
+    "current": (["cur_current", "current", "i"], 1000),
+    "power": (["cur_power", "power", "p"], 10),
+}
 
-            elif code in ["output_power", "power", "cur_power", "p"]:
-                power = value / 10
+SHADOW_METRIC_CODES = {
+    "voltage": (["output_voltage", "voltage", "cur_voltage", "v"], 10),
+    "current": (["output_current", "current", "cur_current", "i"], 1000),
+    "power": (["output_power", "power", "cur_power", "p"], 10),
+}
+
+
+def parse_metrics(items, metric_codes=STATUS_METRIC_CODES):
+    metrics = {"power": None, "voltage": None, "current": None}
+
+    for item in items:
+        code = item.get("code")
+        value = item.get("value")
+
+        if value is None or not isinstance(value, (int, float)):
+            continue
+
+        for name, (codes, scale) in metric_codes.items():
+            if code in codes:
+                metrics[name] = value / scale
+                break
+
+    return metrics
+
+
+def parse_switch(items, switch_code="switch"):
+    for item in items:
+        if item.get("code") == switch_code:
+            return item.get("value")
+
+    if switch_code == "switch_1":
+        for item in items:
+            if item.get("code") == "switch":
+                return item.get("value")
+
+    if switch_code == "switch":
+        for item in items:
+            if item.get("code") == "switch_1":
+                return item.get("value")
+
+    return None
+
+
+# Divisors for sub-units reported by the specification/model endpoints, on top
+# of the 10 ** scale factor (e.g. current in mA with scale 0 -> divide by 1000)
+UNIT_DIVISORS = {"mA": 1000, "mV": 1000, "mW": 1000}
+
+
+def parse_with_datapoints(items, datapoints):
+    values = {item.get("code"): item.get("value") for item in items}
+    metrics = {}
+
+    for name in ("power", "voltage", "current"):
+        code = datapoints.get(f"{name}_code")
+        value = values.get(code) if code else None
+        if value is None or isinstance(value, bool) or not isinstance(value, (int, float)):
+            metrics[name] = None
+        else:
+            metrics[name] = value / datapoints[f"{name}_divisor"]
+
+    switch_code = datapoints.get("switch_code")
+    metrics["switch"] = values.get(switch_code) if switch_code else None
+    return metrics
+
+
+def empty_snapshot():
+    return {"success": False, "code": None, "switch": None,
+            "power": None, "voltage": None, "current": None}
+
+
+def needs_shadow(snapshot):
+    # Only devices whose status was read but carried no metrics; a failed,
+    # throttled or short-circuited request must not fan out into one shadow
+    # call per device while the API is struggling
+    if not snapshot["success"]:
+        return False
+    return all(snapshot[k] is None for k in ("power", "voltage", "current"))
+
+
+def parse_items(items, switch_code, metric_codes, datapoints=None):
+    if datapoints:
+        parsed = parse_with_datapoints(items, datapoints)
+        if parsed["switch"] is None:
+            parsed["switch"] = parse_switch(items, switch_code)
+    else:
+        parsed = parse_metrics(items, metric_codes)
+        parsed["switch"] = parse_switch(items, switch_code)
+    return parsed
+
+
+def apply_status_result(snapshot, result, switch_code="switch", datapoints=None):
+    if not result.get("success"):
+        snapshot["code"] = result.get("code")
+        return snapshot
+
+    status = result.get("result", [])
+    snapshot["success"] = True
+    snapshot.update(parse_items(status, switch_code, STATUS_METRIC_CODES, datapoints))
+    return snapshot
+
+
+def apply_shadow_result(snapshot, result, switch_code="switch", datapoints=None):
+    if not result.get("success"):
+        return snapshot
+
+    properties = result.get("result", {}).get("properties", [])
+    parsed = parse_items(properties, switch_code, SHADOW_METRIC_CODES, datapoints)
+    switch = parsed.pop("switch")
+    snapshot["success"] = True
+    snapshot["code"] = None
+    if snapshot["switch"] is None:
+        snapshot["switch"] = switch
+    snapshot.update(parsed)
+    return snapshot
+
+
+def apply_batch_result(snapshots, result, switch_codes, datapoints=None):
+    if not result.get("success"):
+        return False
+
+    datapoints = datapoints or {}
+    for entry in result.get("result", []):
+        device_id = entry.get("id")
+        if device_id in snapshots:
+            apply_status_result(snapshots[device_id], {"success": True, "result": entry.get("status", [])},
+                                switch_codes.get(device_id, "switch"), datapoints.get(device_id))
+    return True
+
+
+def status_path(device_id):
+    return f"/v1.0/devices/{device_id}/status"
+
+
+def shadow_path(device_id):
+    return f"/v2.0/cloud/thing/{device_id}/shadow/properties"
+
+
+def get_device_snapshot(device_id, access_id, access_key, api_endpoint, token_info,
+                        switch_code="switch", shadow_fallback=True, datapoints=None):
+    snapshot = empty_snapshot()
+    try:
+        if not datapoints or datapoints.get("source") != "shadow":
+            result = request("GET", status_path(device_id), None, None, access_id, access_key, api_endpoint, token_info)
+            apply_status_result(snapshot, result, switch_code, datapoints)
+            if datapoints or not shadow_fallback or not needs_shadow(snapshot):
+                return snapshot
+
+        result = request("GET", shadow_path(device_id), None, None, access_id, access_key, api_endpoint, token_info)
+        apply_shadow_result(snapshot, result, switch_code, datapoints)
+        return snapshot
 
-        return power, voltage, current
-    
     except Exception as e:
-        print(f"Error getting power data: {e}")
-        return None, None, None
+        print(f"Error getting device snapshot: {e}")
+        return snapshot
 
 
-def get_device_switch(device_id, access_id, access_key, api_endpoint, token_info, switch_code="switch"):
+async def async_get_device_snapshots(session, device_ids, access_id, access_key, api_endpoint, token_info,
+                                     switch_codes=None, shadow_fallback=True, semaphore=None,
+                                     datapoints=None):
+    # Snapshots of devices of one cloud project as {device_id: snapshot}.
+    # device_ids is sent in chunks of MAX_BATCH_SIZE, fetched concurrently and
+    # bounded by the optional semaphore. Devices with discovered datapoints
+    # (see discover_datapoints) are read straight from the endpoint that
+    # carries their metrics, without alias scanning or fallback requests.
+    switch_codes = switch_codes or {}
+    datapoints = datapoints or {}
+    snapshots = {device_id: empty_snapshot() for device_id in device_ids}
+    semaphore = semaphore or asyncio.Semaphore(MAX_BATCH_SIZE)
+
+    async def fetch(method, path, params):
+        async with semaphore:
+            return await async_request(session, method, path, params, None,
+                                       access_id, access_key, api_endpoint, token_info)
+
+    shadow_ids = [d for d in device_ids if datapoints.get(d, {}).get("source") == "shadow"]
+    batch_ids = [d for d in device_ids if d not in set(shadow_ids)]
+
+    chunks = [batch_ids[i:i + MAX_BATCH_SIZE] for i in range(0, len(batch_ids), MAX_BATCH_SIZE)]
+    results = await asyncio.gather(*(
+        fetch("GET", BATCH_STATUS_API, {"device_ids": ",".join(chunk)}) for chunk in chunks
+    ))
+
+    for chunk, result in zip(chunks, results):
+        if not apply_batch_result(snapshots, result, switch_codes, datapoints):
+            for device_id in chunk:
+                snapshots[device_id]["code"] = result.get("code")
+
+    pending = list(shadow_ids)
+    if shadow_fallback:
+        pending += [d for d in batch_ids if d not in datapoints and needs_shadow(snapshots[d])]
+    results = await asyncio.gather(*(fetch("GET", shadow_path(d), None) for d in pending))
+    for device_id, result in zip(pending, results):
+        apply_shadow_result(snapshots[device_id], result, switch_codes.get(device_id, "switch"),
+                            datapoints.get(device_id))
+        if not result.get("success") and snapshots[device_id]["code"] is None:
+            snapshots[device_id]["code"] = result.get("code")
+
+    return snapshots
+
+
+def specification_path(device_id):
+    return f"/v1.0/devices/{device_id}/specifications"
+
+
+def model_path(device_id):
+    return f"/v2.0/cloud/thing/{device_id}/model"
+
+
+def parse_json_field(value):
+    if isinstance(value, dict):
+        return value
     try:
-        path = f"/v1.0/devices/{device_id}/status"
-        result = request("GET", path, None, None, access_id, access_key, api_endpoint, token_info)
-        
-        if not result.get("success"):
-            return None
-        
-        status = result.get("result", [])
+        return json.loads(value or "{}")
+    except (TypeError, ValueError):
+        return {}
+
+
+def specification_scales(result):
+    # {code: {"scale": .., "unit": ..}} from /v1.0/devices/{id}/specifications
+    spec = (result.get("result") or {}) if result.get("success") else {}
+    items = (spec.get("status") or []) + (spec.get("functions") or [])
+    return {item.get("code"): parse_json_field(item.get("values")) for item in items}
+
+
+def model_scales(result):
+    # {code: {"scale": .., "unit": ..}} from /v2.0/cloud/thing/{id}/model
+    if not result.get("success"):
+        return {}
+    model = parse_json_field((result.get("result") or {}).get("model"))
+    return {
+        prop.get("code"): prop.get("typeSpec") or {}
+        for service in model.get("services", [])
+        for prop in service.get("properties", [])
+    }
 
-        for item in status:
-            if item.get("code") == switch_code:
-                return item.get("value")
 
-        if switch_code == "switch_1":
-            for item in status:
-                if item.get("code") == "switch":
-                    return item.get("value")
+def datapoint_divisor(spec, default):
+    if not spec or spec.get("scale") is None:
+        return default
+    try:
+        return 10 ** int(spec["scale"]) * UNIT_DIVISORS.get(spec.get("unit"), 1)
+    except (TypeError, ValueError):
+        return default
+
 
-        if switch_code == "switch":
-            for item in status:
-                if item.get("code") == "switch_1":
-                    return item.get("value")
-        
+def build_datapoints(source, items, scales, metric_codes):
+    present = {item.get("code") for item in items}
+    datapoints = {
+        "source": source,
+        "switch_code": next((c for c in ("switch", "switch_1") if c in present or c in scales), None),
+    }
+
+    found = False
+    for name, (codes, default_divisor) in metric_codes.items():
+        code = next((c for c in codes if c in present), None)
+        datapoints[f"{name}_code"] = code
+        datapoints[f"{name}_divisor"] = datapoint_divisor(scales.get(code), default_divisor) if code else None
+        found = found or code is not None
+
+    return datapoints if found else None
+
+
+def has_status_metrics(result):
+    if not result.get("success"):
+        return False
+    codes = {item.get("code") for item in result.get("result", [])}
+    return any(code in codes for aliases, _ in STATUS_METRIC_CODES.values() for code in aliases)
+
+
+def discover_datapoints(device_id, access_id, access_key, api_endpoint, token_info):
+    # One-time probe of which endpoint carries a device's power, voltage and
+    # current, under which codes, and their real scale factors. Returns None
+    # when nothing usable was found so the caller can retry later.
+    def get(path):
+        return request("GET", path, None, None, access_id, access_key, api_endpoint, token_info)
+
+    status_result = get(status_path(device_id))
+    if has_status_metrics(status_result):
+        scales = specification_scales(get(specification_path(device_id)))
+        return build_datapoints("status", status_result["result"], scales, STATUS_METRIC_CODES)
+
+    shadow_result = get(shadow_path(device_id))
+    if not shadow_result.get("success"):
         return None
-    except Exception as e:
-        print(f"Error getting switch status: {e}")
+    scales = model_scales(get(model_path(device_id)))
+    properties = shadow_result.get("result", {}).get("properties", [])
+    return build_datapoints("shadow", properties, scales, SHADOW_METRIC_CODES)
+
+
+async def async_discover_datapoints(session, device_id, access_id, access_key, api_endpoint, token_info,
+                                    semaphore=None):
+    semaphore = semaphore or asyncio.Semaphore(1)
+
+    async def get(path):
+        async with semaphore:
+            return await async_request(session, "GET", path, None, None,
+                                       access_id, access_key, api_endpoint, token_info)
+
+    status_result = await get(status_path(device_id))
+    if has_status_metrics(status_result):
+        scales = specification_scales(await get(specification_path(device_id)))
+        return build_datapoints("status", status_result["result"], scales, STATUS_METRIC_CODES)
+
+    shadow_result = await get(shadow_path(device_id))
+    if not shadow_result.get("success"):
         return None
+    scales = model_scales(await get(model_path(device_id)))
+    properties = shadow_result.get("result", {}).get("properties", [])
+    return build_datapoints("shadow", properties, scales, SHADOW_METRIC_CODES)
+
+
+def get_power_voltage_current(device_id, access_id, access_key, api_endpoint, token_info):
+    snapshot = get_device_snapshot(device_id, access_id, access_key, api_endpoint, token_info)
+    return snapshot["power"], snapshot["voltage"], snapshot["current"]
+
+
+def get_device_switch(device_id, access_id, access_key, api_endpoint, token_info, switch_code="switch"):
+    snapshot = get_device_snapshot(device_id, access_id, access_key, api_endpoint, token_info,
+                                   switch_code, shadow_fallback=False)
+    return snapshot["switch"]
 
 
 def set_device_switch(value: bool, device_id, access_id, access_key, api_endpoint, token_info, switch_code="switch"):
     try:
         path = f"/v1.0/devices/{device_id}/commands"
-        body = {"commands": [{"code": switch_code, "value": value}]}
-        result = request("POST", path, None, body, access_id, access_key, api_endpoint, token_info)
+
+        def send(code):
+            body = {"commands": [{"code": code, "value": value}]}
+            return request("POST", path, None, body, access_id, access_key, api_endpoint, token_info,
+                           PRIORITY_INTERACTIVE)
+
+        result = send(switch_code)
+        if result.get("code") == TOKEN_INVALID_CODE:
+            # Token revoked before its expiry: drop it from the cache and retry once with a new one
+            token_manager.invalidate(access_id, api_endpoint)
+            token_info = token_manager.get_token(access_id, access_key, api_endpoint)
+            if token_info is not None:
+                result = send(switch_code)
         
         if not result.get("success"):
             error_msg = str(result.get("msg", "")).lower()
             if "does not exist" in error_msg or "not support" in error_msg:
                 alt_code = "switch_1" if switch_code == "switch" else "switch"
-                body = {"commands": [{"code": alt_code, "value": value}]}
-                result = request("POST", path, None, body, access_id, access_key, api_endpoint, token_info)
+                result = send(alt_code)
 
                 if result.get("success"):
                     print(f"Device uses '{alt_code}' instead of '{switch_code}'")